@@ -1,7 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
     verbose_name = 'API'
+
+    def ready(self):
+        import api.signals  # noqa: F401
+        if settings.WARMUP_ON_READY:
+            from foodgram import warmup
+            warmup.warm_up_code()
@@ -0,0 +1,97 @@
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+from foodgram import db_router
+
+
+def get_version_key(user_id):
+    return f'auth-user-version:{user_id}'
+
+
+class TokenCache:
+    """
+    LRU-кеш токен -> (пользователь, токен) с ограничением по времени жизни.
+    Запись дополнительно сверяется с версией пользователя в общем кеше,
+    которую сбрасывает invalidate_user в любом воркере. Если версия
+    вытеснена из кеша, запись тоже считается устаревшей. Без общего
+    кеша (CACHE_IS_SHARED) сброс не дошел бы до других воркеров,
+    поэтому кеш токенов не используется.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        if not settings.CACHE_IS_SHARED:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, token, version, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        if cache.get(get_version_key(user.pk)) != version:
+            self.discard(key)
+            return None
+        return user, token
+
+    def set(self, key, user, token):
+        if not settings.CACHE_IS_SHARED:
+            return
+        version_key = get_version_key(user.pk)
+        version = cache.get(version_key)
+        if version is None:
+            cache.add(version_key, uuid.uuid4().hex, None)
+            version = cache.get(version_key)
+            if version is None:
+                return
+        expires = time.monotonic() + settings.AUTH_TOKEN_CACHE_TTL
+        with self._lock:
+            self._entries[key] = (user, token, version, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.AUTH_TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        cache.set(get_version_key(user_id), uuid.uuid4().hex, None)
+        with self._lock:
+            for key in [key for key, entry in self._entries.items()
+                        if entry[0].pk == user_id]:
+                del self._entries[key]
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса к базе для уже известных токенов.
+    Кеш сбрасывается при выходе, смене пароля, деактивации пользователя
+    и удалении токена (см. api.signals).
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            user, token = cached
+            return copy.copy(user), token
+        # Свежесозданный токен может еще не доехать до реплики.
+        with db_router.primary():
+            user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return copy.copy(user), token
@@ -0,0 +1,98 @@
+from django.db import connections, router, transaction
+
+CREATED = 'created'
+EXISTS = 'exists'
+DELETED = 'deleted'
+MISSING = 'missing'
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+
+
+def link(model, **values):
+    """
+    Идемпотентная вставка одной связи одним запросом без предварительной
+    проверки: конфликт по уникальности пропускается базой.
+    Возвращает True, если строка добавлена.
+    """
+    connection = connections[router.db_for_write(model)]
+    ops = connection.ops
+    columns = [model._meta.get_field(name).column for name in values]
+    sql = '{0} {1} ({2}) VALUES ({3}) {4}'.format(
+        ops.insert_statement(ignore_conflicts=True),
+        ops.quote_name(model._meta.db_table),
+        ', '.join(ops.quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns)),
+        ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(values.values()))
+        return cursor.rowcount == 1
+
+
+def unlink(model, **values):
+    """Удаление связи одним DELETE, True - если строка была."""
+    deleted, _ = model.objects.filter(**values).delete()
+    return deleted > 0
+
+
+def _unique(ids):
+    return list(dict.fromkeys(ids))
+
+
+def _results(ids, statuses):
+    return [{'id': pk, 'status': statuses[pk]} for pk in ids]
+
+
+def add(model, field, user, ids, target_model, exclude=()):
+    """
+    Связывает user со всеми существующими объектами ids одним
+    bulk_create: запрос существующих целей, запрос уже связанных и вставка.
+    Повторная связь из параллельного запроса гасится ignore_conflicts.
+    """
+    ids = _unique(ids)
+    found = set(target_model.objects.filter(pk__in=ids).values_list(
+        'pk', flat=True))
+    linked = set(model.objects.filter(
+        user=user, **{f'{field}__in': found}).values_list(field, flat=True))
+    statuses = {}
+    for pk in ids:
+        if pk not in found:
+            statuses[pk] = NOT_FOUND
+        elif pk in exclude:
+            statuses[pk] = FORBIDDEN
+        elif pk in linked:
+            statuses[pk] = EXISTS
+        else:
+            statuses[pk] = CREATED
+    model.objects.bulk_create(
+        [model(user=user, **{f'{field}_id': pk})
+         for pk in ids if statuses[pk] == CREATED],
+        ignore_conflicts=True
+    )
+    return _results(ids, statuses)
+
+
+def remove(model, field, user, ids):
+    """Удаляет связи user с ids одним delete после выборки связанных."""
+    ids = _unique(ids)
+    links = model.objects.filter(user=user, **{f'{field}__in': ids})
+    linked = set(links.values_list(field, flat=True))
+    if linked:
+        links.delete()
+    return _results(ids, {pk: DELETED if pk in linked else MISSING
+                          for pk in ids})
+
+
+@transaction.atomic
+def replace(model, field, user, ids, target_model):
+    """
+    Оставляет у user связи ровно с существующими объектами ids:
+    лишние удаляются, недостающие добавляются в одной транзакции.
+    """
+    ids = _unique(ids)
+    links = model.objects.filter(user=user)
+    removed = list(links.exclude(**{f'{field}__in': ids}).values_list(
+        field, flat=True))
+    if removed:
+        links.filter(**{f'{field}__in': removed}).delete()
+    return add(model, field, user, ids, target_model), removed
@@ -0,0 +1,218 @@
+import hashlib
+import math
+import random
+import time
+import uuid
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from foodgram import db_router, metrics
+
+RECIPES_VERSION_KEY = 'recipes-version'
+CATALOG_VERSION_KEY = 'catalog-version'
+LIST_PARAMS = ('page', 'limit', 'tags', 'author', 'fields', 'omit')
+
+
+def get_author_version_key(author_id):
+    return f'recipes-version:author:{author_id}'
+
+
+def get_version(key):
+    """Текущая версия; при отсутствии в кеше заводится новая."""
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_recipes_version(author_id=None):
+    """Рецепты изменились: все закешированные страницы устаревают."""
+    version = time.time_ns()
+    cache.set(RECIPES_VERSION_KEY, version, None)
+    if author_id is not None:
+        cache.set(get_author_version_key(author_id), version, None)
+
+
+def bump_catalog_version():
+    """Изменились теги или ингредиенты, которые выводятся в рецептах."""
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), None)
+    bump_recipes_version()
+
+
+def get_list_key(request):
+    """
+    Ключ и версия страницы списка рецептов: нормализованные page, limit,
+    tags, author и набор полей. Список одного автора зависит только
+    от его версии и версии справочников.
+    """
+    params = request.query_params
+    normalized = [
+        (name, sorted(set(params.getlist(name))))
+        for name in LIST_PARAMS if params.getlist(name)
+    ]
+    if 'page' not in params:
+        normalized.append(('page', ['1']))
+    normalized.sort()
+    author = params.getlist('author')
+    if len(author) == 1:
+        version = '{0}.{1}'.format(
+            get_version(get_author_version_key(author[0])),
+            get_version(CATALOG_VERSION_KEY))
+    else:
+        version = get_version(RECIPES_VERSION_KEY)
+    url = '{0}?{1}'.format(request.build_absolute_uri(request.path),
+                           urlencode(normalized, doseq=True))
+    return f'recipes-list:{_digest(url)}', version
+
+
+def get_detail_key(request, pk):
+    return ('recipes-detail:{0}:{1}'.format(
+        _digest(request.build_absolute_uri('/')), pk),
+        get_version(RECIPES_VERSION_KEY))
+
+
+def get_catalog_key(request, name):
+    """Ключ и версия списка тегов или ингредиентов с учетом поиска."""
+    search = request.query_params.get('name', '').lower()
+    return (f'catalog:{name}:{_digest(search)}',
+            get_version(CATALOG_VERSION_KEY))
+
+
+def _digest(value):
+    # Абсолютные ссылки на картинки и страницы зависят от хоста.
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+class Uncacheable(Exception):
+    """Результат вычисления нельзя сохранять, например ответ с ошибкой."""
+
+    def __init__(self, result):
+        super().__init__()
+        self.result = result
+
+
+def single_flight(key, compute, timeout, stale_key=None, name='cache'):
+    """
+    Кеш с защитой от одновременного пересчета одного ключа.
+
+    Пересчет выполняет только воркер, получивший блокировку key:lock
+    на SINGLE_FLIGHT_LEASE секунд. Остальные отдают устаревшее значение
+    (из stale_key, если сам ключ уже сменил версию) или ждут результат.
+    Значение пересчитывается заранее с вероятностью, растущей к концу
+    срока жизни и пропорциональной времени вычисления (XFetch).
+    """
+    envelope = cache.get(key)
+    if envelope is not None:
+        value, expires, delta = envelope
+        early = delta * settings.SINGLE_FLIGHT_BETA * math.log(
+            1 - random.random())
+        if time.time() - early < expires:
+            metrics.store.inc('foodgram_response_cache_total', cache=name,
+                              result='hit')
+            return value
+    elif stale_key is not None:
+        envelope = cache.get(stale_key)
+
+    lock_key = f'{key}:lock'
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_LEASE
+    while True:
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, settings.SINGLE_FLIGHT_LEASE):
+            metrics.store.inc('foodgram_response_cache_total', cache=name,
+                              result='miss')
+            try:
+                return _recompute(key, compute, timeout, stale_key)
+            finally:
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+        if envelope is not None:
+            metrics.store.inc('foodgram_response_cache_total', cache=name,
+                              result='stale')
+            return envelope[0]
+        if time.monotonic() > deadline:
+            # Владелец блокировки не уложился в аренду.
+            return _recompute(key, compute, timeout, stale_key)
+        time.sleep(settings.SINGLE_FLIGHT_POLL)
+        fresh = cache.get(key)
+        if fresh is not None:
+            return fresh[0]
+
+
+def _recompute(key, compute, timeout, stale_key):
+    start = time.time()
+    value = compute()
+    envelope = (value, start + timeout, time.time() - start)
+    hard_timeout = timeout + settings.SINGLE_FLIGHT_STALE
+    cache.set(key, envelope, hard_timeout)
+    if stale_key is not None:
+        cache.set(stale_key, envelope, hard_timeout)
+    return value
+
+
+def cached_response(key, compute, name='recipes', timeout=None):
+    """
+    Отдает сохраненные данные ответа или вычисляет их через single_flight,
+    сохраняются только успешные ответы. key - пара (ключ, версия).
+    Пересчет идет по основной базе, чтобы под новой версией
+    не оказались данные отстающей реплики.
+    """
+    def compute_data():
+        with db_router.primary():
+            response = compute()
+        if response.status_code != 200:
+            raise Uncacheable(response)
+        return response.data
+
+    base_key, version = key
+    if timeout is None:
+        timeout = settings.RESPONSE_CACHE_TIMEOUT
+    try:
+        return Response(single_flight(f'{base_key}:{version}', compute_data,
+                                      timeout, stale_key=base_key,
+                                      name=name))
+    except Uncacheable as error:
+        return error.result
+
+
+def get_fragment_key(recipe_id, author_version, catalog_version):
+    return f'recipe-fragment:{recipe_id}:{author_version}.{catalog_version}'
+
+
+def get_fragments(rows, build):
+    """
+    Независимые от пользователя представления рецептов по строкам
+    (id, author_id) в порядке строк. Отсутствующие в кеше строятся
+    одним вызовом build(ids) -> {id: представление}.
+    """
+    author_keys = {author_id: get_author_version_key(author_id)
+                   for _, author_id in rows}
+    versions = cache.get_many(author_keys.values())
+    catalog_version = get_version(CATALOG_VERSION_KEY)
+    keys = {}
+    for recipe_id, author_id in rows:
+        key = author_keys[author_id]
+        author_version = versions.get(key) or get_version(key)
+        keys[recipe_id] = get_fragment_key(recipe_id, author_version,
+                                           catalog_version)
+    cached = cache.get_many(keys.values())
+    fragments = {recipe_id: cached[key] for recipe_id, key in keys.items()
+                 if key in cached}
+    missing = [recipe_id for recipe_id in keys if recipe_id not in fragments]
+    metrics.store.inc('foodgram_response_cache_total', len(fragments),
+                      cache='fragments', result='hit')
+    metrics.store.inc('foodgram_response_cache_total', len(missing),
+                      cache='fragments', result='miss')
+    if missing:
+        with db_router.primary():
+            built = build(missing)
+        cache.set_many({keys[recipe_id]: fragment
+                        for recipe_id, fragment in built.items()},
+                       settings.RESPONSE_CACHE_TIMEOUT)
+        fragments.update(built)
+    return [fragments[recipe_id] for recipe_id, _ in rows
+            if recipe_id in fragments]
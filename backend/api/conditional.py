@@ -0,0 +1,95 @@
+import hashlib
+
+from django.db.models import Exists, OuterRef
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from recipes.models import BuyRecipe, FavoriteRecipe, Recipe
+from users.models import Follow, User
+
+
+def get_etag(request, *parts):
+    """
+    Валидатор ответа: URL с параметрами (fields, omit), формат ответа
+    и значения parts, от которых зависит тело.
+    """
+    digest = hashlib.md5(repr((
+        request.get_full_path(), request.META.get('HTTP_ACCEPT'), parts
+    )).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def respond(request, validators, build):
+    """
+    Отдает 304 по If-None-Match / If-Modified-Since до сборки ответа,
+    иначе собирает ответ build() и проставляет валидаторы.
+    validators - пара (etag, дата изменения), дата изменения
+    передается только для ответов без пользовательских флагов.
+    """
+    etag, updated_at = validators
+    # Last-Modified передается с точностью до секунды.
+    last_modified = int(updated_at.timestamp()) if updated_at else None
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is None:
+        response = build()
+        if response.status_code != 200:
+            return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ('Accept', 'Authorization'))
+    return response
+
+
+def get_recipe_validators(request, pk):
+    """
+    Валидаторы рецепта одним запросом по первичному ключу: дата
+    изменения и, для пользователя, флаги избранного, покупок и подписки.
+    """
+    user = request.user
+    recipes = Recipe.objects.filter(pk=_to_pk(pk))
+    columns = ['updated_at']
+    if not user.is_anonymous:
+        recipes = recipes.annotate(
+            favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            in_cart=Exists(BuyRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            followed=Exists(Follow.objects.filter(
+                user=user, following=OuterRef('author'))),
+        )
+        columns += ['favorited', 'in_cart', 'followed']
+    return _get_validators(request, recipes.values_list(*columns))
+
+
+def get_user_validators(request, pk):
+    """Валидаторы профиля: дата изменения и подписка на него."""
+    user = request.user
+    users = User.objects.filter(pk=_to_pk(pk))
+    columns = ['updated_at']
+    if not user.is_anonymous:
+        users = users.annotate(followed=Exists(Follow.objects.filter(
+            user=user, following=OuterRef('pk'))))
+        columns.append('followed')
+    return _get_validators(request, users.values_list(*columns))
+
+
+def _to_pk(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise Http404
+
+
+def _get_validators(request, rows):
+    row = rows.first()
+    if row is None:
+        raise Http404
+    updated_at, *flags = row
+    etag = get_etag(request, updated_at.isoformat(), *flags)
+    if request.user.is_anonymous:
+        return etag, updated_at
+    # Флаги меняются без изменения даты, проверять можно только по ETag.
+    return etag, None
@@ -0,0 +1,226 @@
+import gzip
+import json
+import sqlite3
+import sys
+from datetime import datetime
+
+from django.db import connection
+from django.db.models import Max
+
+from recipes.models import (BuyRecipe,
+                            FavoriteRecipe,
+                            Ingredient,
+                            IngredientRecipe,
+                            Recipe,
+                            Tag)
+from users.models import Follow, User
+
+FORMAT = 'foodgram-corpus'
+VERSION = 1
+
+
+class Section:
+    """
+    Раздел выгрузки: модель, колонки и ссылки на другие разделы.
+    key - естественный ключ, по которому строка находится в целевой
+    базе; разделы без ключа - таблицы связей, их повторная вставка
+    пропускается по уникальности.
+    """
+
+    def __init__(self, name, model, fields, refs=None, key=None):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.refs = refs or {}
+        self.key = key
+
+    def get_rows(self, chunk_size):
+        columns = ('id', *self.fields) if self.key else self.fields
+        queryset = self.model.objects.order_by(
+            'pk').values_list(*columns).iterator(chunk_size=chunk_size)
+        for values in queryset:
+            yield dict(zip(columns, values))
+
+    def get_key(self, values):
+        return tuple(values[name] for name in self.key)
+
+    def to_python(self, row):
+        return {name: self.model._meta.get_field(name).to_python(row[name])
+                for name in self.fields}
+
+
+SECTIONS = (
+    Section('user', User,
+            ('username', 'email', 'first_name', 'last_name', 'password',
+             'is_active', 'date_joined'),
+            key=('email',)),
+    Section('tag', Tag, ('name', 'color', 'slug'), key=('slug',)),
+    Section('ingredient', Ingredient, ('name', 'measurement_unit'),
+            key=('name', 'measurement_unit')),
+    Section('recipe', Recipe,
+            ('author_id', 'name', 'image', 'text', 'cooking_time',
+             'pub_date'),
+            refs={'author_id': 'user'},
+            key=('pub_date', 'author_id', 'name')),
+    Section('recipe_tag', Recipe.tags.through, ('recipe_id', 'tag_id'),
+            refs={'recipe_id': 'recipe', 'tag_id': 'tag'}),
+    Section('ingredient_recipe', IngredientRecipe,
+            ('recipe_id', 'ingredient_id', 'amount'),
+            refs={'recipe_id': 'recipe', 'ingredient_id': 'ingredient'}),
+    Section('follow', Follow, ('user_id', 'following_id'),
+            refs={'user_id': 'user', 'following_id': 'user'}),
+    Section('favorite', FavoriteRecipe, ('user_id', 'recipe_id'),
+            refs={'user_id': 'user', 'recipe_id': 'recipe'}),
+    Section('cart', BuyRecipe, ('user_id', 'recipe_id'),
+            refs={'user_id': 'user', 'recipe_id': 'recipe'}),
+)
+SECTIONS_BY_NAME = {section.name: section for section in SECTIONS}
+
+
+def open_file(path, mode):
+    """Файл выгрузки: '-' - стандартный поток, *.gz - со сжатием."""
+    if path == '-':
+        return sys.stdout if 'w' in mode else sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def dump(row):
+    return json.dumps(row, ensure_ascii=False, default=_encode,
+                      separators=(',', ':'))
+
+
+def _encode(value):
+    # Даты с микросекундами: pub_date входит в естественный ключ рецепта.
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} не сериализуется в JSON')
+
+
+class State:
+    """
+    Состояние загрузки в файле SQLite: соответствие исходных первичных
+    ключей новым и номер последней примененной строки. Соответствие
+    ключей хранится на диске, поэтому память не растет с размером
+    выгрузки.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            'CREATE TABLE IF NOT EXISTS pk_map ('
+            ' section TEXT, source INTEGER, target INTEGER,'
+            ' PRIMARY KEY (section, source)) WITHOUT ROWID;'
+            'CREATE TABLE IF NOT EXISTS progress ('
+            ' name TEXT PRIMARY KEY, value INTEGER);')
+
+    @property
+    def line(self):
+        row = self.db.execute(
+            "SELECT value FROM progress WHERE name = 'line'").fetchone()
+        return row[0] if row else 0
+
+    def get_many(self, section, sources):
+        sources = list(set(sources))
+        mapping = {}
+        # Ограничение SQLite на число параметров запроса.
+        for start in range(0, len(sources), 500):
+            batch = sources[start:start + 500]
+            mapping.update(self.db.execute(
+                'SELECT source, target FROM pk_map '
+                'WHERE section = ? AND source IN ({0})'.format(
+                    ', '.join('?' * len(batch))),
+                [section, *batch]))
+        return mapping
+
+    def targets(self, section, batch_size):
+        last = 0
+        while True:
+            batch = [target for target, in self.db.execute(
+                'SELECT target FROM pk_map WHERE section = ? AND target > ? '
+                'ORDER BY target LIMIT ?', (section, last, batch_size))]
+            if not batch:
+                return
+            yield batch
+            last = batch[-1]
+
+    def commit(self, section, mapping, line):
+        self.db.executemany(
+            'INSERT OR REPLACE INTO pk_map VALUES (?, ?, ?)',
+            [(section, source, target) for source, target in mapping.items()])
+        self.db.execute(
+            "INSERT OR REPLACE INTO progress VALUES ('line', ?)", (line,))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def bulk_insert(model, objects):
+    """
+    bulk_create с первичными ключами в объектах и для баз без
+    RETURNING в массовой вставке (SQLite): внутри транзакции записи
+    SQLite выдает ключи новым строкам по возрастанию.
+    """
+    if connection.features.can_return_rows_from_bulk_insert or not objects:
+        return model.objects.bulk_create(objects)
+    last_id = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    model.objects.bulk_create(objects)
+    new_ids = model.objects.filter(pk__gt=last_id).order_by(
+        'pk').values_list('pk', flat=True)
+    for obj, pk in zip(objects, new_ids):
+        obj.pk = pk
+    return objects
+
+
+def import_rows(section, rows, state):
+    """
+    Вставка пачки строк раздела в текущей транзакции. Возвращает
+    соответствие исходных ключей новым и число пропущенных строк
+    (ссылаются на строки, которых нет в выгрузке).
+    """
+    mapping = {}
+    refs = {ref: state.get_many(target, [row[ref] for row in rows])
+            for ref, target in section.refs.items()}
+    values = []
+    for row in rows:
+        if all(row[ref] in refs[ref] for ref in refs):
+            item = section.to_python(row)
+            for ref in refs:
+                item[ref] = refs[ref][row[ref]]
+            values.append((row.get('id'), item))
+    skipped = len(rows) - len(values)
+    model = section.model
+    if section.key is None:
+        model.objects.bulk_create((model(**item) for _, item in values),
+                                  ignore_conflicts=True)
+        return mapping, skipped
+
+    # Строки, уже перенесенные прежним запуском или существующие
+    # в целевой базе, сопоставляются по естественному ключу.
+    first = section.key[0]
+    existing = {
+        section.get_key(dict(zip(('pk', *section.key), found))): found[0]
+        for found in model.objects.filter(**{
+            f'{first}__in': {item[first] for _, item in values}
+        }).values_list('pk', *section.key)
+    }
+    created = []
+    for source, item in values:
+        target = existing.get(section.get_key(item))
+        if target is None:
+            created.append((source, item, model(**item)))
+        else:
+            mapping[source] = target
+    bulk_insert(model, [obj for _, _, obj in created])
+    # auto_now_add при вставке заменяет даты текущим временем.
+    dates = [name for name in section.fields
+             if getattr(model._meta.get_field(name), 'auto_now_add', False)]
+    for source, item, obj in created:
+        mapping[source] = obj.pk
+        for name in dates:
+            setattr(obj, name, item[name])
+    if dates and created:
+        model.objects.bulk_update([obj for _, _, obj in created], dates)
+    return mapping, skipped
@@ -0,0 +1,163 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (BuyRecipe,
+                            DeletionJob,
+                            FavoriteRecipe,
+                            IngredientRecipe,
+                            Recipe,
+                            RecipeChange,
+                            RecipeDocument)
+from users.models import Follow, User
+from . import cache, readmodels
+from .authentication import token_cache
+
+
+def tombstone_recipe(recipe):
+    """
+    Рецепт сразу пропадает из API: отметка deleted_at, документ
+    и запись журнала. Связанные строки удалит DeletionJob.
+    """
+    with transaction.atomic():
+        Recipe.all_objects.filter(pk=recipe.pk).update(
+            deleted_at=timezone.now())
+        RecipeDocument.objects.filter(recipe_id=recipe.pk).delete()
+        readmodels.record_changes([recipe.pk], RecipeChange.DELETED)
+        job = DeletionJob.objects.create(kind=DeletionJob.RECIPE,
+                                         object_id=recipe.pk)
+        transaction.on_commit(
+            lambda: cache.bump_recipes_version(recipe.author_id))
+    return job
+
+
+def tombstone_user(user):
+    """
+    Пользователь и его рецепты скрываются несколькими запросами без
+    загрузки связанных объектов, токены отзываются. Удаление рецептов
+    сразу попадает в журнал изменений, id читаются пачками.
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        User.all_objects.filter(pk=user.pk).update(deleted_at=now,
+                                                   is_active=False)
+        Token.objects.filter(user_id=user.pk).delete()
+        recipes = Recipe.objects.filter(author_id=user.pk).order_by('pk')
+        last_id = 0
+        while True:
+            recipe_ids = list(recipes.filter(pk__gt=last_id).values_list(
+                'pk', flat=True)[:settings.DELETION_BATCH_SIZE])
+            if not recipe_ids:
+                break
+            readmodels.record_changes(recipe_ids, RecipeChange.DELETED)
+            last_id = recipe_ids[-1]
+        recipes.update(deleted_at=now)
+        RecipeDocument.objects.filter(recipe__author_id=user.pk).delete()
+        job = DeletionJob.objects.create(kind=DeletionJob.USER,
+                                         object_id=user.pk)
+
+        def invalidate():
+            token_cache.invalidate_user(user.pk)
+            cache.bump_recipes_version(user.pk)
+
+        transaction.on_commit(invalidate)
+    return job
+
+
+def claim_job():
+    """
+    Следующая задача в очереди или зависшая дольше
+    DELETION_JOB_TIMEOUT. Задачу забирает тот процесс, чей условный
+    UPDATE изменил строку.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.DELETION_JOB_TIMEOUT)
+    jobs = DeletionJob.objects.filter(
+        Q(status=DeletionJob.PENDING)
+        | Q(status=DeletionJob.RUNNING, updated_at__lt=stale))
+    for job in jobs[:10]:
+        if jobs.filter(pk=job.pk, updated_at=job.updated_at).update(
+                status=DeletionJob.RUNNING, updated_at=timezone.now()):
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job, batch_size, report=None):
+    """
+    Удаляет строки задачи пачками по batch_size, каждая пачка в своей
+    короткой транзакции, прогресс сохраняется после каждой пачки.
+    Повторный запуск после сбоя продолжает с оставшихся строк.
+    """
+    try:
+        if job.kind == DeletionJob.USER:
+            steps = get_user_steps(job.object_id, batch_size)
+        else:
+            steps = get_recipe_steps([job.object_id], batch_size)
+        for step, deleted in steps:
+            job.step = step
+            job.deleted += deleted
+            job.save(update_fields=['step', 'deleted', 'updated_at'])
+            if report:
+                report(job)
+    except Exception as error:
+        job.status = DeletionJob.FAILED
+        job.error = repr(error)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        raise
+    job.status = DeletionJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at', 'updated_at'])
+
+
+def get_user_steps(user_id, batch_size):
+    recipes = Recipe.all_objects.filter(author_id=user_id).order_by('pk')
+    while True:
+        recipe_ids = list(recipes.values_list('pk', flat=True)[:batch_size])
+        if not recipe_ids:
+            break
+        yield from get_recipe_steps(recipe_ids, batch_size)
+    for step, queryset in (
+        ('favorites', FavoriteRecipe.objects.filter(user_id=user_id)),
+        ('cart', BuyRecipe.objects.filter(user_id=user_id)),
+        ('follows', Follow.objects.filter(user_id=user_id)),
+        ('followers', Follow.objects.filter(following_id=user_id)),
+        ('user', User.all_objects.filter(pk=user_id)),
+    ):
+        yield from delete_in_batches(step, queryset, batch_size)
+
+
+def get_recipe_steps(recipe_ids, batch_size):
+    """Дочерние строки рецептов, затем сами рецепты."""
+    for step, queryset in (
+        ('ingredients', IngredientRecipe.objects.filter(
+            recipe_id__in=recipe_ids)),
+        ('tags', Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids)),
+        ('recipe_favorites', FavoriteRecipe.objects.filter(
+            recipe_id__in=recipe_ids)),
+        ('recipe_cart', BuyRecipe.objects.filter(recipe_id__in=recipe_ids)),
+        ('documents', RecipeDocument.objects.filter(
+            recipe_id__in=recipe_ids)),
+        ('recipes', Recipe.all_objects.filter(pk__in=recipe_ids)),
+    ):
+        yield from delete_in_batches(step, queryset, batch_size)
+
+
+def delete_in_batches(step, queryset, batch_size):
+    """
+    Удаление по первичным ключам пачками: в памяти не больше batch_size
+    объектов, блокировки держатся только на время одной пачки.
+    """
+    queryset = queryset.order_by('pk')
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        with transaction.atomic():
+            deleted, _ = queryset.model._base_manager.filter(
+                pk__in=ids).delete()
+        yield step, deleted
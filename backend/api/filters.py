@@ -1,3 +1,4 @@
+from django import forms
 from django.contrib.auth import get_user_model
 from django_filters.rest_framework import FilterSet, filters
 from rest_framework.filters import SearchFilter
@@ -7,8 +8,22 @@ from recipes.models import Recipe
 User = get_user_model()
 
 
+class AnyValueMultipleChoiceField(forms.MultipleChoiceField):
+    def valid_value(self, value):
+        return True
+
+
+class AnyValuesMultipleFilter(filters.MultipleChoiceFilter):
+    """
+    Фильтр по нескольким значениям без проверки по списку допустимых:
+    неизвестный слаг дает пустую выборку, а не ошибку 400.
+    """
+
+    field_class = AnyValueMultipleChoiceField
+
+
 class RecipeFilters(FilterSet):
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = AnyValuesMultipleFilter(field_name='tags__slug')
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
@@ -0,0 +1,92 @@
+from recipes.models import BuyRecipe, FavoriteRecipe
+from users.models import Follow
+from . import readmodels
+
+
+class DataLoader:
+    """
+    Загрузка по ключам в рамках одного запроса: ключи копятся через
+    prime и догружаются одним вызовом batch(keys) -> {ключ: значение}
+    при первом обращении. Загруженное запоминается до конца запроса.
+    """
+
+    def __init__(self, batch):
+        self._batch = batch
+        self._values = {}
+        self._queue = []
+
+    def prime(self, keys):
+        self._queue.extend(key for key in keys if key not in self._values)
+
+    def dispatch(self):
+        keys = list(dict.fromkeys(self._queue))
+        self._queue = []
+        if keys:
+            loaded = self._batch(keys)
+            for key in keys:
+                self._values[key] = loaded.get(key)
+
+    def load_many(self, keys):
+        """Значения в порядке keys, None для отсутствующих."""
+        keys = list(keys)
+        self.prime(keys)
+        self.dispatch()
+        return [self._values[key] for key in keys]
+
+    def load(self, key):
+        return self.load_many([key])[0]
+
+
+def get_loader(request, name, batch):
+    """
+    Загрузчик name, общий для всех сериализаторов запроса.
+    Без запроса (сериализатор вне представления) загрузчик одноразовый.
+    """
+    if request is None:
+        return DataLoader(batch)
+    loaders = request.__dict__.setdefault('_loaders', {})
+    if name not in loaders:
+        loaders[name] = DataLoader(batch)
+    return loaders[name]
+
+
+def _flags(model, field, user):
+    def batch(keys):
+        found = set(model.objects.filter(
+            user=user, **{f'{field}__in': keys}).values_list(field, flat=True))
+        return {key: key in found for key in keys}
+    return batch
+
+
+def get_favorited_loader(request):
+    return get_loader(request, 'favorited',
+                      _flags(FavoriteRecipe, 'recipe', request.user))
+
+
+def get_in_cart_loader(request):
+    return get_loader(request, 'in_cart',
+                      _flags(BuyRecipe, 'recipe', request.user))
+
+
+def get_followed_loader(request):
+    return get_loader(request, 'followed',
+                      _flags(Follow, 'following', request.user))
+
+
+def get_recipes_loader(request, fields=None):
+    """
+    Представления рецептов без пользовательских флагов: полные из
+    документов, усеченные до fields - из нужных колонок.
+    """
+    if fields is None:
+        return get_loader(request, 'recipes', readmodels.get_documents)
+    return get_loader(request, ('recipes', fields),
+                      lambda keys: readmodels.build_fragments(keys, fields))
+
+
+def get_tags_loader(request):
+    return get_loader(request, 'tags', readmodels.get_tags)
+
+
+def get_ingredients_loader(request):
+    return get_loader(request, 'ingredients', readmodels.get_ingredients)
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """Нагрузка на запущенный сервер заданным числом одновременных
+    соединений: сравнение профилей WSGI и ASGI на одном эндпоинте."""
+
+    help = 'concurrent load against a running server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', type=str,
+                            help='например http://localhost:9050/api/recipes/')
+        parser.add_argument('--concurrency', default=100, type=int)
+        parser.add_argument('--duration', default=10, type=float)
+        parser.add_argument('--token', type=str)
+        parser.add_argument('--slow-send', default=0, type=float,
+                            help='пауза клиента посреди отправки запроса, с')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError('Поддерживается только http://')
+        latencies, errors = asyncio.run(self.run(url, options))
+        if not latencies:
+            raise CommandError(f'Нет успешных ответов, ошибок: {errors}')
+        latencies.sort()
+        self.stdout.write(
+            'Соединений: {0}, ответов: {1}, ошибок: {2}\n'
+            'Ответов в секунду: {3:.1f}\n'
+            'p50: {4:.1f} мс, p95: {5:.1f} мс, p99: {6:.1f} мс'.format(
+                options['concurrency'], len(latencies), errors,
+                len(latencies) / options['duration'],
+                self.percentile(latencies, 50) * 1000,
+                self.percentile(latencies, 95) * 1000,
+                self.percentile(latencies, 99) * 1000))
+
+    async def run(self, url, options):
+        path = url.path or '/'
+        if url.query:
+            path = f'{path}?{url.query}'
+        headers = [f'GET {path} HTTP/1.1', f'Host: {url.netloc}',
+                   'Connection: close']
+        if options['token']:
+            headers.append(f'Authorization: Token {options["token"]}')
+        request = ('\r\n'.join(headers) + '\r\n\r\n').encode()
+        deadline = time.monotonic() + options['duration']
+        latencies = []
+        errors = 0
+
+        async def client():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                try:
+                    reader, writer = await asyncio.open_connection(
+                        url.hostname, url.port or 80)
+                    if options['slow_send']:
+                        # Медленный клиент: заголовки приходят частями.
+                        writer.write(request[:len(request) // 2])
+                        await writer.drain()
+                        await asyncio.sleep(options['slow_send'])
+                        writer.write(request[len(request) // 2:])
+                    else:
+                        writer.write(request)
+                    await writer.drain()
+                    status = (await reader.readline()).split()
+                    await reader.read()
+                    writer.close()
+                except OSError:
+                    errors += 1
+                    continue
+                if len(status) > 1 and status[1] == b'200':
+                    latencies.append(time.monotonic() - start)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(client()
+                               for _ in range(options['concurrency'])))
+        return latencies, errors
+
+    @staticmethod
+    def percentile(values, percent):
+        return values[min(len(values) - 1, len(values) * percent // 100)]
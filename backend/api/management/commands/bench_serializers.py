@@ -0,0 +1,106 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.readmodels import apply_user_flags, build_fragments
+from api.serializers import RecipeGetSerializer
+from recipes.models import (Ingredient,
+                            IngredientRecipe,
+                            Recipe,
+                            Tag)
+from users.models import User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """Сравнение стоимости сериализации списка рецептов
+    RecipeGetSerializer и сборки из values_list."""
+
+    help = 'benchmark recipe list serialization per 1000 recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', default=1000, type=int)
+        parser.add_argument('--repeat', default=3, type=int)
+        parser.add_argument('--fixture', action='store_true',
+                            help='создать временные рецепты и откатить их')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['fixture']:
+                    self.create_fixture(options['count'])
+                self.run(options['count'], options['repeat'])
+                if options['fixture']:
+                    raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, count, repeat):
+        recipe_ids = list(Recipe.objects.order_by(
+            '-pub_date', 'id').values_list('id', flat=True)[:count])
+        if not recipe_ids:
+            raise CommandError('Нет рецептов, используйте --fixture')
+        request = Request(APIRequestFactory().get(
+            '/api/recipes/', HTTP_HOST=settings.ALLOWED_HOSTS[0]))
+        renderer = JSONRenderer()
+
+        def serializer_path():
+            recipes = Recipe.objects.filter(pk__in=recipe_ids).order_by(
+                '-pub_date', 'id').select_related('author').prefetch_related(
+                    'tags')
+            return renderer.render(RecipeGetSerializer(
+                recipes, many=True, context={'request': request}).data)
+
+        def read_model_path():
+            fragments = build_fragments(recipe_ids)
+            return renderer.render(apply_user_flags(
+                [fragments[pk] for pk in recipe_ids if pk in fragments],
+                request))
+
+        if read_model_path() != serializer_path():
+            raise CommandError('Ответы двух путей различаются')
+        self.stdout.write(f'Рецептов: {len(recipe_ids)}, ответы совпадают')
+        for name, path in (('RecipeGetSerializer', serializer_path),
+                           ('values_list', read_model_path)):
+            best = min(self.measure(path) for _ in range(repeat))
+            self.stdout.write('{0}: {1:.1f} мс на 1000 рецептов'.format(
+                name, best * 1000 * 1000 / len(recipe_ids)))
+
+    @staticmethod
+    def measure(path):
+        start = time.perf_counter()
+        path()
+        return time.perf_counter() - start
+
+    @staticmethod
+    def create_fixture(count):
+        author = User.objects.create(username='bench_author',
+                                     email='bench@foodgram.local',
+                                     first_name='bench',
+                                     last_name='bench')
+        tags = [Tag.objects.create(name=f'bench{i}', color=f'#BE{i:04d}',
+                                   slug=f'bench{i}') for i in range(3)]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'bench{i}', measurement_unit='г')
+            for i in range(10))
+        ingredients = list(Ingredient.objects.filter(
+            name__startswith='bench'))
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'bench{i}', text='bench',
+                   image='recipes/images/bench.png', cooking_time=10)
+            for i in range(count))
+        recipes = list(Recipe.objects.filter(author=author))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+            for recipe in recipes for tag in tags[:2])
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=5)
+            for recipe in recipes for ingredient in ingredients[:4])
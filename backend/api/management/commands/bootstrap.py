@@ -0,0 +1,122 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import cache, readmodels
+from api.signals import touch_recipes
+from recipes import catalog
+from recipes.models import Ingredient, Recipe, Tag
+
+ROOT_DATA = os.path.join(settings.BASE_DIR, 'data')
+TAG_FIELDS = ('name', 'color')
+
+
+class Command(BaseCommand):
+    """Начальные данные из декларативного файла BASE_DIR / data:
+    администратор, теги и справочник ингредиентов, а также недостающие
+    документы рецептов. Повторный запуск
+    ничего не меняет и укладывается в несколько запросов чтения."""
+
+    help = 'apply seed file: admin user, tags, ingredients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename', default='seed.json', nargs='?',
+                            type=str)
+        parser.add_argument('--batch-size', default=1000, type=int)
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        seed = self.load(options['filename'])
+        ingredients = list(seed.get('ingredients', ()))
+        if seed.get('ingredients_file'):
+            ingredients += self.load(seed['ingredients_file'])
+        with transaction.atomic():
+            admin = self.apply_admin(seed.get('admin'))
+            tags = self.apply_tags(seed.get('tags', ()))
+            created = self.apply_ingredients(ingredients,
+                                             options['batch_size'])
+            if tags or created:
+                transaction.on_commit(cache.bump_catalog_version)
+            if created:
+                catalog.schedule_build()
+        # Документы рецептов, созданных до появления RecipeDocument
+        # или загруженных в обход API.
+        documents = readmodels.rebuild_documents_for(Recipe.objects.all(),
+                                                     missing_only=True)
+        self.stdout.write(
+            'Администратор: {0}, тегов изменено: {1}, '
+            'ингредиентов добавлено: {2}, документов рецептов '
+            'создано: {3} ({4:.2f} с)'.format(
+                admin, tags, created, documents, time.monotonic() - start))
+
+    def load(self, filename):
+        try:
+            with open(os.path.join(ROOT_DATA, filename), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise CommandError(f'Файл {filename} отсутствует')
+
+    def apply_admin(self, data):
+        """Пароль берется из ADMIN_PASSWORD и задается только при
+        создании: проверка хеша на каждом запуске стоила бы дороже
+        всей команды."""
+        if not data:
+            return 'не задан'
+        User = get_user_model()
+        user = User.objects.filter(username=data['username']).first()
+        if user is None:
+            password = os.getenv('ADMIN_PASSWORD')
+            if not password:
+                raise CommandError('Не задана переменная ADMIN_PASSWORD')
+            User.objects.create_superuser(password=password, **data)
+            return 'создан'
+        changed = {field: value for field, value in data.items()
+                   if getattr(user, field) != value}
+        if not (user.is_staff and user.is_superuser):
+            changed.update(is_staff=True, is_superuser=True)
+        if not changed:
+            return 'без изменений'
+        for field, value in changed.items():
+            setattr(user, field, value)
+        user.save(update_fields=[*changed, 'updated_at'])
+        return 'обновлен'
+
+    def apply_tags(self, data):
+        existing = {tag.slug: tag for tag in Tag.objects.all()}
+        created, updated = [], []
+        for item in data:
+            tag = existing.get(item['slug'])
+            if tag is None:
+                created.append(Tag(**item))
+            elif any(getattr(tag, field) != item[field]
+                     for field in TAG_FIELDS):
+                for field in TAG_FIELDS:
+                    setattr(tag, field, item[field])
+                updated.append(tag)
+        # Массовые операции не вызывают сигналы: рецепты с измененными
+        # тегами обновляются здесь.
+        Tag.objects.bulk_create(created)
+        if updated:
+            Tag.objects.bulk_update(updated, TAG_FIELDS)
+            touch_recipes(Recipe.objects.filter(tags__in=updated).distinct())
+        return len(created) + len(updated)
+
+    def apply_ingredients(self, data, batch_size):
+        """Ингредиент определяется парой (название, единица), поэтому
+        изменять нечего: добавляются только отсутствующие."""
+        existing = set(Ingredient.objects.values_list(
+            'name', 'measurement_unit'))
+        missing = {}
+        for item in data:
+            key = (item['name'], item['measurement_unit'])
+            if key not in existing:
+                missing[key] = Ingredient(name=key[0],
+                                          measurement_unit=key[1])
+        Ingredient.objects.bulk_create(missing.values(),
+                                       batch_size=batch_size)
+        return len(missing)
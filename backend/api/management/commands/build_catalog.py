@@ -0,0 +1,26 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes import catalog
+
+
+class Command(BaseCommand):
+    """Пересборка снимка справочника ингредиентов CATALOG_SNAPSHOT_PATH
+    (обычно выполняется автоматически при изменении ингредиентов)."""
+
+    help = 'rebuild memory-mapped ingredient catalog snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str,
+                            default=settings.CATALOG_SNAPSHOT_PATH)
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        count = catalog.build_snapshot(options['path'])
+        self.stdout.write('Ингредиентов: {0}, размер: {1} КБ ({2:.2f} с)'
+                          .format(count,
+                                  os.path.getsize(options['path']) // 1024,
+                                  time.monotonic() - start))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import corpus
+
+
+class Command(BaseCommand):
+    """Потоковая выгрузка пользователей, справочников, рецептов и связей
+    в NDJSON: строки читаются курсором пачками, память не зависит от
+    объема. Картинки рецептов переносятся отдельно, в выгрузке - пути."""
+
+    help = 'stream corpus to NDJSON for import_corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str,
+                            help="файл выгрузки, '-' - stdout, *.gz - сжатый")
+        parser.add_argument('--batch-size', default=2000, type=int)
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        out = corpus.open_file(options['path'], 'w')
+        try:
+            out.write(corpus.dump({'format': corpus.FORMAT,
+                                   'version': corpus.VERSION}) + '\n')
+            for section in corpus.SECTIONS:
+                count = 0
+                for row in section.get_rows(options['batch_size']):
+                    out.write(corpus.dump({'section': section.name, **row})
+                              + '\n')
+                    count += 1
+                self.stderr.write(f'{section.name}: {count}')
+        finally:
+            if options['path'] != '-':
+                out.close()
+        self.stderr.write('Готово за {0:.1f} с'.format(
+            time.monotonic() - start))
@@ -0,0 +1,96 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Удаление картинок рецептов, на которые не ссылается ни один рецепт
+    (в том числе ожидающий удаления DeletionJob). Каталог читается
+    потоком, ссылки проверяются запросом по индексу на пачку файлов,
+    поэтому память не зависит от числа файлов и рецептов.
+    """
+
+    help = 'remove unreferenced recipe images from MEDIA_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='только отчет о том, что будет удалено')
+        parser.add_argument('--batch-size', default=1000, type=int)
+        parser.add_argument('--min-age', default=settings.MEDIA_GC_MIN_AGE,
+                            type=int, help='не трогать файлы моложе, с')
+
+    def handle(self, *args, **options):
+        field = Recipe._meta.get_field('image')
+        storage = field.storage
+        try:
+            root = storage.path('')
+        except NotImplementedError:
+            raise CommandError('Поддерживается только локальное хранилище')
+        directory = os.path.join(root, field.upload_to)
+        deadline = time.time() - options['min_age']
+        files = count = size = 0
+        for batch in self.batches(self.walk(root, directory, deadline),
+                                  options['batch_size']):
+            files += len(batch)
+            referenced = set(Recipe.all_objects.filter(
+                image__in=batch).values_list('image', flat=True))
+            for name, file_size in batch.items():
+                if name in referenced:
+                    continue
+                if not options['dry_run']:
+                    if not self.is_stale(storage.path(name), deadline):
+                        continue
+                    storage.delete(name)
+                count += 1
+                size += file_size
+            if not options['dry_run']:
+                self.stdout.write(f'Проверено {files}, удалено {count}')
+        self.stdout.write(
+            '{0}: файлов без ссылок {1} из {2}, {3:.1f} МБ'.format(
+                'Можно освободить' if options['dry_run'] else 'Освобождено',
+                count, files, size / 2 ** 20))
+
+    @classmethod
+    def walk(cls, root, directory, deadline):
+        """Имена файлов относительно MEDIA_ROOT и их размер."""
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from cls.walk(root, entry.path, deadline)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime < deadline:
+                        name = os.path.relpath(entry.path, root)
+                        yield name.replace(os.sep, '/'), stat.st_size
+
+    @staticmethod
+    def is_stale(path, deadline):
+        """
+        Повторная проверка перед удалением: пока шел запрос ссылок,
+        файл могли загрузить заново (ContentHashStorage обновляет дату),
+        а рецепт с ним еще не сохранен.
+        """
+        try:
+            return os.stat(path).st_mtime < deadline
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def batches(files, size):
+        batch = {}
+        for name, file_size in files:
+            batch[name] = file_size
+            if len(batch) == size:
+                yield batch
+                batch = {}
+        if batch:
+            yield batch
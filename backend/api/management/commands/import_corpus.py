@@ -0,0 +1,107 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from api import cache, corpus, readmodels
+from recipes import catalog
+
+
+class Command(BaseCommand):
+    """
+    Загрузка выгрузки export_corpus. Разделы вставляются пачками
+    в порядке зависимостей с заменой первичных ключей. Соответствие
+    ключей и прогресс хранятся в файле состояния, прерванная загрузка
+    продолжается с последней примененной пачки; повторно примененная
+    пачка ничего не дублирует.
+    """
+
+    help = 'load NDJSON corpus with pk remapping, resumable'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str,
+                            help="файл выгрузки, '-' - stdin, *.gz - сжатый")
+        parser.add_argument('--state', type=str,
+                            help='файл состояния, по умолчанию <path>.state')
+        parser.add_argument('--batch-size', default=1000, type=int)
+        parser.add_argument('--restart', action='store_true',
+                            help='начать заново, удалив файл состояния')
+
+    def handle(self, *args, **options):
+        state_path = options['state'] or f'{options["path"]}.state'
+        if options['path'] == '-' and not options['state']:
+            raise CommandError('Для stdin укажите --state')
+        if options['restart'] and os.path.exists(state_path):
+            os.remove(state_path)
+        start = time.monotonic()
+        state = corpus.State(state_path)
+        source = corpus.open_file(options['path'], 'r')
+        try:
+            self.check_header(source)
+            done = state.line
+            if done:
+                self.stderr.write(f'Продолжение после строки {done}')
+            lines = islice(enumerate(source, start=2), max(done - 1, 0), None)
+            for section, rows, line in self.batches(lines,
+                                                    options['batch_size']):
+                self.apply(section, rows, line, state)
+            self.finish(state)
+        finally:
+            if options['path'] != '-':
+                source.close()
+            state.close()
+        self.stderr.write('Готово за {0:.1f} с'.format(
+            time.monotonic() - start))
+
+    def check_header(self, source):
+        header = json.loads(next(source, '{}'))
+        if (header.get('format') != corpus.FORMAT
+                or header.get('version') != corpus.VERSION):
+            raise CommandError('Файл не является выгрузкой export_corpus')
+
+    @staticmethod
+    def batches(lines, size):
+        """Пачки строк одного раздела и номер последней строки пачки."""
+        section, rows, line = None, [], 0
+        for line, text in lines:
+            row = json.loads(text)
+            name = row.pop('section')
+            if rows and (name != section.name or len(rows) == size):
+                yield section, rows, line - 1
+                rows = []
+            if section is None or name != section.name:
+                section = corpus.SECTIONS_BY_NAME.get(name)
+                if section is None:
+                    raise CommandError(f'Строка {line}: раздел {name}')
+            rows.append(row)
+        if rows:
+            yield section, rows, line
+
+    def apply(self, section, rows, line, state):
+        try:
+            with transaction.atomic():
+                mapping, skipped = corpus.import_rows(section, rows, state)
+        except IntegrityError as error:
+            raise CommandError(
+                f'{section.name}, строки до {line}: {error}') from error
+        # Состояние сохраняется после коммита: если процесс прервется
+        # между ними, пачка применится еще раз без дублей.
+        state.commit(section.name, mapping, line)
+        message = f'{section.name}: {len(rows)}, строка {line}'
+        if skipped:
+            message += f', без связанных строк пропущено: {skipped}'
+        self.stderr.write(message)
+
+    def finish(self, state):
+        """Массовая вставка не вызывает сигналы: документы рецептов,
+        журнал изменений, снимок справочника и версии кеша
+        обновляются здесь."""
+        for batch in state.targets('recipe', settings.DOCUMENT_BATCH_SIZE):
+            readmodels.rebuild_documents(batch)
+            readmodels.record_changes(batch)
+        catalog.build_snapshot()
+        cache.bump_catalog_version()
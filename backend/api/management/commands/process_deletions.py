@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import deletion
+
+
+class Command(BaseCommand):
+    """Выполнение задач DeletionJob: связанные строки удаленных
+    пользователей и рецептов удаляются пачками."""
+
+    help = 'process pending tombstone deletion jobs in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.DELETION_BATCH_SIZE)
+        parser.add_argument('--loop', type=float, default=0,
+                            help='опрашивать очередь с паузой, с')
+
+    def handle(self, *args, **options):
+        while True:
+            job = deletion.claim_job()
+            if job is not None:
+                self.stdout.write(f'{job.kind} {job.object_id}: начало')
+                deletion.run_job(job, options['batch_size'], self.report)
+                self.stdout.write(
+                    f'{job.kind} {job.object_id}: удалено строк '
+                    f'{job.deleted}')
+            elif options['loop']:
+                time.sleep(options['loop'])
+            else:
+                return
+
+    def report(self, job):
+        self.stdout.write(f'{job.kind} {job.object_id}: {job.step}, '
+                          f'удалено строк {job.deleted}')
@@ -0,0 +1,31 @@
+import io
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foodgram import profiling
+
+
+class Command(BaseCommand):
+    """Сводный отчет по сохраненным профилям запросов
+    из PROFILE_DIR."""
+
+    help = 'top functions report from collected request profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', type=str,
+                            help='обработчик, например RecipesViewSet.list')
+        parser.add_argument('--sort', default='cumulative', type=str,
+                            choices=('cumulative', 'tottime', 'ncalls'))
+        parser.add_argument('--limit', default=30, type=int)
+
+    def handle(self, *args, **options):
+        dumps = profiling.list_dumps(options['view'])
+        if not dumps:
+            raise CommandError('Профили не найдены')
+        report = io.StringIO()
+        stats = pstats.Stats(*dumps, stream=report)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(
+            options['limit'])
+        self.stdout.write(f'Профилей: {len(dumps)}')
+        self.stdout.write(report.getvalue())
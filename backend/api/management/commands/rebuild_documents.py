@@ -0,0 +1,62 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api import cache
+from api.readmodels import rebuild_documents
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Пересборка документов рецептов RecipeDocument
+    пачками в несколько потоков."""
+
+    help = 'rebuild materialized recipe documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.DOCUMENT_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        recipe_ids = Recipe.objects.order_by('id').values_list(
+            'id', flat=True).iterator(chunk_size=options['batch_size'])
+        # В очереди не больше двух пачек на поток: идентификаторы
+        # читаются по мере пересборки, а не все сразу.
+        limit = options['workers'] * 2
+        self.done = 0
+        with ThreadPoolExecutor(options['workers']) as executor:
+            futures = set()
+            for batch in self.batches(recipe_ids, options['batch_size']):
+                if len(futures) >= limit:
+                    finished, futures = wait(futures,
+                                             return_when=FIRST_COMPLETED)
+                    self.report(finished)
+                futures.add(executor.submit(self.rebuild, batch))
+            self.report(wait(futures).done)
+        cache.bump_catalog_version()
+
+    def report(self, finished):
+        for future in finished:
+            self.done += future.result()
+        self.stdout.write(f'Пересобрано документов: {self.done}')
+
+    @staticmethod
+    def batches(recipe_ids, size):
+        batch = []
+        for recipe_id in recipe_ids:
+            batch.append(recipe_id)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def rebuild(batch):
+        try:
+            return len(rebuild_documents(batch))
+        finally:
+            connections.close_all()
@@ -0,0 +1,307 @@
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import (BuyRecipe,
+                            FavoriteRecipe,
+                            IngredientRecipe,
+                            Recipe,
+                            RecipeChange,
+                            RecipeDocument)
+from users.models import Follow, User
+from . import cache
+
+RECIPE_FIELDS = ('id',
+                 'tags',
+                 'author',
+                 'ingredients',
+                 'is_favorited',
+                 'is_in_shopping_cart',
+                 'name',
+                 'image',
+                 'text',
+                 'cooking_time')
+RECIPE_COLUMNS = ('name', 'image', 'text', 'cooking_time')
+AUTHOR_COLUMNS = ('email', 'username', 'first_name', 'last_name')
+_pending = threading.local()
+
+
+def get_tags(recipe_ids):
+    """Теги рецептов одним запросом: {id рецепта: [тег, ...]}."""
+    tags = defaultdict(list)
+    for recipe_id, tag_id, name, color, slug in (
+        Recipe.tags.through.objects.filter(recipe_id__in=recipe_ids)
+        .values_list('recipe_id', 'tag_id', 'tag__name', 'tag__color',
+                     'tag__slug')
+        .order_by('tag__name')
+    ):
+        tags[recipe_id].append(
+            {'id': tag_id, 'name': name, 'color': color, 'slug': slug})
+    return tags
+
+
+def get_ingredients(recipe_ids):
+    """Ингредиенты рецептов одним запросом: {id рецепта: [...]}."""
+    ingredients = defaultdict(list)
+    for recipe_id, ingredient_id, name, unit, amount in (
+        IngredientRecipe.objects.filter(recipe_id__in=recipe_ids)
+        .values_list('recipe_id', 'ingredient_id', 'ingredient__name',
+                     'ingredient__measurement_unit', 'amount')
+        .order_by('ingredient__name')
+    ):
+        ingredients[recipe_id].append({'id': ingredient_id,
+                                       'name': name,
+                                       'measurement_unit': unit,
+                                       'amount': amount})
+    return ingredients
+
+
+def get_output_fields(fields):
+    """Поля представления с id: по нему накладываются флаги
+    пользователя и сопоставляются рецепты."""
+    return fields if 'id' in fields else ('id', *fields)
+
+
+def build_fragments(recipe_ids, fields=RECIPE_FIELDS):
+    """
+    Представления рецептов в формате RecipeGetSerializer без
+    пользовательских флагов и с относительными ссылками на картинки.
+    Собираются из values_list не более чем четырьмя запросами на любой
+    размер пачки, без создания моделей и сериализаторов. Для полей
+    не из fields запросы и колонки не используются; id выводится всегда,
+    лишний убирает apply_user_flags.
+    """
+    columns = ['id', 'author_id'] + [name for name in RECIPE_COLUMNS
+                                     if name in fields]
+    recipes = list(Recipe.objects.filter(pk__in=recipe_ids).values(*columns))
+    recipe_ids = [row['id'] for row in recipes]
+
+    authors = {}
+    if 'author' in fields:
+        authors = {
+            author_id: (email, username, first_name, last_name)
+            for author_id, email, username, first_name, last_name
+            in User.objects.filter(
+                pk__in={row['author_id'] for row in recipes}
+            ).values_list('id', *AUTHOR_COLUMNS)
+        }
+    tags = defaultdict(list)
+    if 'tags' in fields:
+        tags = get_tags(recipe_ids)
+    ingredients = defaultdict(list)
+    if 'ingredients' in fields:
+        ingredients = get_ingredients(recipe_ids)
+
+    storage = Recipe._meta.get_field('image').storage
+    fragments = {}
+    for row in recipes:
+        recipe_id = row['id']
+        values = {'tags': tags[recipe_id],
+                  'ingredients': ingredients[recipe_id],
+                  'is_favorited': False,
+                  'is_in_shopping_cart': False}
+        if 'author' in fields:
+            email, username, first_name, last_name = authors[
+                row['author_id']]
+            values['author'] = {'email': email,
+                                'id': row['author_id'],
+                                'username': username,
+                                'first_name': first_name,
+                                'last_name': last_name,
+                                'is_subscribed': False}
+        if 'image' in fields:
+            values['image'] = (storage.url(row['image']) if row['image']
+                               else None)
+        fragments[recipe_id] = {
+            name: values[name] if name in values else row[name]
+            for name in get_output_fields(fields)
+        }
+    return fragments
+
+
+def rebuild_documents(recipe_ids):
+    """Пересобирает документы рецептов в текущей транзакции."""
+    recipe_ids = list(recipe_ids)
+    fragments = build_fragments(recipe_ids)
+    with transaction.atomic():
+        RecipeDocument.objects.filter(recipe_id__in=recipe_ids).delete()
+        _insert_documents(fragments)
+    return fragments
+
+
+def rebuild_on_commit(recipe_ids):
+    """
+    Пересобирает документы рецептов и сбрасывает кеш их авторов после
+    фиксации транзакции, когда уже сохранены теги и ингредиенты.
+    Рецепт пересобирается один раз, сколько бы изменений ни вошло
+    в транзакцию.
+    """
+    pending = _pending.__dict__.setdefault('recipe_ids', set())
+    pending.update(recipe_ids)
+    transaction.on_commit(_rebuild_pending)
+
+
+def _rebuild_pending():
+    recipe_ids = _pending.__dict__.pop('recipe_ids', None)
+    if not recipe_ids:
+        return
+    fragments = rebuild_documents(recipe_ids)
+    for author_id in {fragment['author']['id']
+                      for fragment in fragments.values()}:
+        cache.bump_recipes_version(author_id)
+
+
+def create_documents(recipe_ids):
+    """
+    Сохраняет недостающие документы. Документ, который тем временем
+    создал параллельный запрос или запись рецепта, не перезаписывается.
+    """
+    fragments = build_fragments(recipe_ids)
+    _insert_documents(fragments)
+    return fragments
+
+
+def _insert_documents(fragments):
+    # Параллельная вставка того же рецепта не должна давать IntegrityError.
+    RecipeDocument.objects.bulk_create(
+        (RecipeDocument(recipe_id=recipe_id, payload=payload)
+         for recipe_id, payload in fragments.items()),
+        ignore_conflicts=True)
+
+
+def rebuild_documents_for(queryset, missing_only=False):
+    """
+    Пересборка документов рецептов из queryset пачками, с missing_only
+    только создание отсутствующих. Возвращает число документов.
+    """
+    if missing_only:
+        queryset = queryset.filter(document__isnull=True)
+    recipe_ids = queryset.values_list('id', flat=True).order_by('id')
+    rebuild = create_documents if missing_only else rebuild_documents
+    batch_size = settings.DOCUMENT_BATCH_SIZE
+    last_id = 0
+    count = 0
+    while True:
+        batch = list(recipe_ids.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return count
+        count += len(rebuild(batch))
+        last_id = batch[-1]
+
+
+def get_documents(recipe_ids):
+    """
+    Представления рецептов из документов одним запросом по ключам,
+    недостающие документы собираются и сохраняются.
+    """
+    documents = dict(RecipeDocument.objects.filter(
+        recipe_id__in=recipe_ids).values_list('recipe_id', 'payload'))
+    missing = [recipe_id for recipe_id in recipe_ids
+               if recipe_id not in documents]
+    if missing:
+        documents.update(create_documents(missing))
+    return documents
+
+
+def record_changes(recipe_ids, action=RecipeChange.UPDATED):
+    """
+    После коммита переносит рецепты в конец журнала изменений:
+    прежние записи по ним заменяются новой.
+    """
+    recipe_ids = list(recipe_ids)
+
+    def record():
+        size = settings.DOCUMENT_BATCH_SIZE
+        with transaction.atomic():
+            for start in range(0, len(recipe_ids), size):
+                batch = recipe_ids[start:start + size]
+                RecipeChange.objects.filter(recipe_id__in=batch).delete()
+                RecipeChange.objects.bulk_create(
+                    RecipeChange(recipe_id=recipe_id, action=action)
+                    for recipe_id in batch)
+
+    if recipe_ids:
+        transaction.on_commit(record)
+
+
+def get_changes(since, limit):
+    """
+    Записи журнала после курсора since. Самые свежие записи
+    отдаются спустя CHANGES_SETTLE_SECONDS, чтобы параллельные
+    транзакции успели зафиксировать записи с меньшими номерами.
+    """
+    settled = timezone.now() - timedelta(
+        seconds=settings.CHANGES_SETTLE_SECONDS)
+    return list(RecipeChange.objects.filter(
+        id__gt=since, changed_at__lte=settled
+    ).values_list('id', 'recipe_id', 'action')[:limit])
+
+
+def get_user_flags(user, recipe_ids, author_ids, fields=RECIPE_FIELDS):
+    """Три запроса вместо трех запросов на каждый рецепт страницы."""
+    favorited = in_cart = followed = set()
+    if 'is_favorited' in fields:
+        favorited = set(FavoriteRecipe.objects.filter(
+            user=user, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True))
+    if 'is_in_shopping_cart' in fields:
+        in_cart = set(BuyRecipe.objects.filter(
+            user=user, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True))
+    if 'author' in fields:
+        followed = set(Follow.objects.filter(
+            user=user, following_id__in=author_ids
+        ).values_list('following_id', flat=True))
+    return favorited, in_cart, followed
+
+
+def apply_user_flags(recipes, request, fields=RECIPE_FIELDS):
+    """
+    Накладывает на представления флаги текущего пользователя
+    и абсолютные ссылки на картинки, как RecipeGetSerializer.
+    Если id не запрошен, он удаляется после наложения флагов.
+    """
+    user = request.user
+    if user.is_anonymous:
+        favorited = in_cart = followed = set()
+    else:
+        favorited, in_cart, followed = get_user_flags(
+            user,
+            [recipe['id'] for recipe in recipes],
+            {recipe['author']['id'] for recipe in recipes
+             if 'author' in recipe} - {user.id},
+            fields,
+        )
+    for recipe in recipes:
+        if 'author' in recipe:
+            recipe['author']['is_subscribed'] = (recipe['author']['id']
+                                                 in followed)
+        if 'is_favorited' in recipe:
+            recipe['is_favorited'] = recipe['id'] in favorited
+        if 'is_in_shopping_cart' in recipe:
+            recipe['is_in_shopping_cart'] = recipe['id'] in in_cart
+        if recipe.get('image'):
+            recipe['image'] = request.build_absolute_uri(recipe['image'])
+    if 'id' not in fields:
+        for recipe in recipes:
+            recipe.pop('id', None)
+    return recipes
+
+
+def get_recipes(rows, request, fields=None):
+    """
+    Страница рецептов по строкам (id, author_id). Полные представления
+    берутся из кеша и документов, усеченные до fields собираются
+    напрямую только из нужных колонок и таблиц.
+    """
+    if fields is None:
+        return apply_user_flags(cache.get_fragments(rows, get_documents),
+                                request)
+    fragments = build_fragments([recipe_id for recipe_id, _ in rows],
+                                fields)
+    return apply_user_flags([fragments[recipe_id] for recipe_id, _ in rows
+                             if recipe_id in fragments], request, fields)
@@ -1,11 +1,13 @@
 import base64
+from django.conf import settings
 from django.core.files.base import ContentFile
-from django.db.models import F
+from django.db import models, transaction
 from rest_framework import serializers, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.relations import PrimaryKeyRelatedField
 
 from foodgram.constants import DICT_ERRORS
+from . import loaders
 from recipes.models import (BuyRecipe,
                             Ingredient,
                             IngredientRecipe,
@@ -15,7 +17,72 @@ from recipes.models import (BuyRecipe,
 from users.models import Follow, User
 
 
-class UserSerializer(serializers.ModelSerializer):
+def get_sparse_fields(query_params, available):
+    """
+    Поля ответа по параметрам fields= и omit= (через запятую)
+    в порядке available; None, если параметры не переданы.
+    """
+    fields = [name for name in query_params.get('fields', '').split(',')
+              if name]
+    omit = [name for name in query_params.get('omit', '').split(',')
+            if name]
+    if not (fields or omit):
+        return None
+    unknown = set(fields + omit) - set(available)
+    if unknown:
+        raise ValidationError({'fields': '{0}: {1}'.format(
+            DICT_ERRORS.get('unknown_fields'), ', '.join(sorted(unknown)))})
+    return tuple(name for name in available
+                 if (not fields or name in fields) and name not in omit)
+
+
+class PrimedListSerializer(serializers.ListSerializer):
+    """
+    Перед выводом списка передает все объекты в загрузчики
+    дочернего сериализатора, чтобы они догрузились одним запросом.
+    """
+
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = data.all()
+        data = list(data)
+        self.child.prime(data)
+        return super().to_representation(data)
+
+
+class SparseFieldsMixin:
+    """Оставляет в сериализаторе только поля из context['fields']."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """Список id для массовых операций."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS
+    )
+
+
+class ChangesQuerySerializer(serializers.Serializer):
+    """Курсор и размер пачки ленты изменений рецептов."""
+
+    since = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.CHANGES_BATCH_SIZE,
+        default=settings.CHANGES_BATCH_SIZE
+    )
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Сериализатор пользователя User."""
 
     is_subscribed = serializers.SerializerMethodField()
@@ -28,12 +95,27 @@ class UserSerializer(serializers.ModelSerializer):
                   'first_name',
                   'last_name',
                   'is_subscribed')
+        list_serializer_class = PrimedListSerializer
+
+    def prime(self, users):
+        self.prime_ids(user.pk for user in users)
+
+    def prime_ids(self, user_ids):
+        """Подписки на пользователей user_ids проверяются одним запросом."""
+        request = self.context.get('request')
+        if request is not None and not request.user.is_anonymous:
+            loaders.get_followed_loader(request).prime(
+                user_id for user_id in user_ids
+                if user_id != request.user.pk)
 
     def get_is_subscribed(self, obj):
         """Проверка подписки у пользователя."""
-        user = self.context.get('request').user
+        request = self.context.get('request')
+        if request is None:
+            return False
+        user = request.user
         return (not (user.is_anonymous or user == obj)
-                and user.follower.filter(following=obj).exists())
+                and loaders.get_followed_loader(request).load(obj.pk))
 
 
 class RecipesShortSerializer(serializers.ModelSerializer):
@@ -48,7 +130,7 @@ class RecipesShortSerializer(serializers.ModelSerializer):
         read_only_fields = ('__all__',)
 
 
-class ShowFollowSerializer(serializers.ModelSerializer):
+class ShowFollowSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """ Сериализатор для отображения подписок пользователя. """
 
     recipes = RecipesShortSerializer(many=True, read_only=True)
@@ -69,10 +151,14 @@ class ShowFollowSerializer(serializers.ModelSerializer):
 
     def get_recipes_count(self, obj):
         """Количество подписок у пользователя."""
+        if hasattr(obj, 'recipes_total'):
+            return obj.recipes_total
         return obj.recipes.count()
 
     def to_representation(self, instance):
         rep = super().to_representation(instance)
+        if 'recipes' not in rep:
+            return rep
         request = self.root.context.get('request')
         if request is not None:
             count = request.query_params.get('recipes_limit')
@@ -144,7 +230,7 @@ class Base64ImageField(serializers.ImageField):
 class RecipeGetSerializer(serializers.ModelSerializer):
     """Сериализатор рецептов Recipe для GET запросов."""
 
-    tags = TagSerializer(many=True, read_only=True)
+    tags = serializers.SerializerMethodField()
     author = UserSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
@@ -164,26 +250,48 @@ class RecipeGetSerializer(serializers.ModelSerializer):
                   'text',
                   'cooking_time')
         read_only_fields = ('__all__',)
+        list_serializer_class = PrimedListSerializer
+
+    def prime(self, recipes):
+        """
+        Теги, ингредиенты, флаги пользователя и подписки на авторов
+        всего списка загружаются по одному запросу на тип.
+        """
+        request = self.context.get('request')
+        recipe_ids = [recipe.pk for recipe in recipes]
+        loaders.get_tags_loader(request).prime(recipe_ids)
+        loaders.get_ingredients_loader(request).prime(recipe_ids)
+        if request is not None and not request.user.is_anonymous:
+            loaders.get_favorited_loader(request).prime(recipe_ids)
+            loaders.get_in_cart_loader(request).prime(recipe_ids)
+        self.fields['author'].prime_ids(
+            recipe.author_id for recipe in recipes)
+
+    def get_tags(self, obj):
+        """Получение тегов."""
+        return loaders.get_tags_loader(self.context.get('request')).load(
+            obj.pk) or []
 
     def get_ingredients(self, obj):
         """Получение ингридиентов."""
-        return obj.ingredients.values('id',
-                                      'name',
-                                      'measurement_unit',
-                                      amount=F('recipe__amount'))
+        return loaders.get_ingredients_loader(
+            self.context.get('request')).load(obj.pk) or []
 
     def get_is_favorited(self, obj):
         """Проверка рецепта в избранных у пользователя."""
-        user = self.context.get('request').user
-        return not user.is_anonymous and FavoriteRecipe.objects.filter(
-            user=user, recipe=obj).exists()
+        request = self.context.get('request')
+        if request is None:
+            return False
+        return (not request.user.is_anonymous
+                and loaders.get_favorited_loader(request).load(obj.pk))
 
     def get_is_in_shopping_cart(self, obj):
         """Проверка рецепта в покупках у пользователя."""
-        user = self.context.get('request').user
-        return not user.is_anonymous and BuyRecipe.objects.filter(
-            user=user, recipe=obj
-        ).exists()
+        request = self.context.get('request')
+        if request is None:
+            return False
+        return (not request.user.is_anonymous
+                and loaders.get_in_cart_loader(request).load(obj.pk))
 
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
@@ -262,11 +370,17 @@ class RecipeSetSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({
                 'ingredients':
                 '{0}'.format(DICT_ERRORS.get('not_ingredient'))})
+        # Все ингредиенты одним запросом, а не запрос на каждый.
+        try:
+            found = Ingredient.objects.in_bulk(
+                {int(item['id']) for item in ingredients})
+        except (KeyError, TypeError, ValueError):
+            found = {}
         ingredient_list = []
         for item in ingredients:
             try:
-                ingredient = Ingredient.objects.get(pk=item['id'])
-            except Ingredient.DoesNotExist:
+                ingredient = found[int(item['id'])]
+            except (KeyError, TypeError, ValueError):
                 raise serializers.ValidationError(
                     '{0}'.format(DICT_ERRORS.get('not_in-db_ingredient'))
                 )
@@ -280,23 +394,25 @@ class RecipeSetSerializer(serializers.ModelSerializer):
                     'ingredients':
                     ('{0}'.format(DICT_ERRORS.get('null_ingredient')))
                 })
-        data['ingredients'] = ingredients
+        data['ingredients'] = [
+            {'ingredient': ingredient, 'amount': item['amount']}
+            for ingredient, item in zip(ingredient_list, ingredients)
+        ]
         return data
 
     @staticmethod
     def get_ingredient(recipe, ingredients):
-        ingredients_obj = []
-        for ingredient in ingredients:
-            ingredient_obj = Ingredient.objects.get(id=ingredient.get('id'))
-            ingredients_obj.append(
-                IngredientRecipe(
-                    ingredient=ingredient_obj,
-                    amount=ingredient.get('amount'),
-                    recipe=recipe
-                )
+        """Ингредиенты уже загружены в validate."""
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                ingredient=ingredient['ingredient'],
+                amount=ingredient['amount'],
+                recipe=recipe
             )
-        IngredientRecipe.objects.bulk_create(ingredients_obj)
+            for ingredient in ingredients
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
@@ -306,6 +422,7 @@ class RecipeSetSerializer(serializers.ModelSerializer):
         self.get_ingredient(recipe, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         instance.image = validated_data.get('image', instance.image)
         instance.tags.clear()
@@ -314,7 +431,8 @@ class RecipeSetSerializer(serializers.ModelSerializer):
         IngredientRecipe.objects.filter(recipe=instance).all().delete()
         ingredient_list = validated_data.pop('ingredients')
         self.get_ingredient(instance, ingredient_list)
-        return super().update(instance, validated_data)
+        instance = super().update(instance, validated_data)
+        return instance
 
     def to_representation(self, instance):
         request = self.context.get('request')
@@ -0,0 +1,147 @@
+from django.contrib.auth import user_logged_out
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from foodgram import events
+from recipes import catalog
+from recipes.models import (Ingredient, IngredientRecipe, Recipe,
+                            RecipeChange, Tag)
+from users.models import User
+from . import cache, readmodels
+from .authentication import token_cache
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    """Удаление токена, в том числе при auth/token/logout/."""
+    token_cache.discard(instance.key)
+    token_cache.invalidate_user(instance.user_id)
+
+
+@receiver(user_logged_out)
+def invalidate_logged_out_user(sender, user, **kwargs):
+    if user is not None:
+        token_cache.invalidate_user(user.pk)
+
+
+@receiver(post_save, sender=User)
+def invalidate_changed_user(sender, instance, update_fields, **kwargs):
+    """Смена пароля, деактивация и любые другие изменения пользователя."""
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def remember_catalog_recipes(sender, instance, **kwargs):
+    """После удаления связи с рецептами уже не найти."""
+    instance.document_recipe_ids = list(
+        get_catalog_recipes(instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def rebuild_catalog_recipes(sender, instance, **kwargs):
+    recipe_ids = getattr(instance, 'document_recipe_ids', None)
+    if recipe_ids is None:
+        recipes = get_catalog_recipes(instance)
+    else:
+        recipes = Recipe.objects.filter(id__in=recipe_ids)
+    touch_recipes(recipes)
+    transaction.on_commit(cache.bump_catalog_version)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def rebuild_catalog_snapshot(sender, **kwargs):
+    catalog.schedule_build()
+
+
+@receiver(pre_save, sender=User)
+def remember_author_columns(sender, instance, update_fields, **kwargs):
+    """Сохраненные значения полей автора, которые выводятся в рецептах."""
+    instance.stored_author_columns = None
+    if instance.pk is None or (
+            update_fields is not None
+            and not set(update_fields) & set(readmodels.AUTHOR_COLUMNS)):
+        return
+    instance.stored_author_columns = User.objects.filter(
+        pk=instance.pk).values_list(*readmodels.AUTHOR_COLUMNS).first()
+
+
+@receiver(post_save, sender=User)
+def rebuild_author_recipes(sender, instance, **kwargs):
+    """
+    Данные автора выводятся в каждом его рецепте: рецепты
+    пересобираются, только если эти данные изменились.
+    """
+    stored = getattr(instance, 'stored_author_columns', None)
+    if stored is None or stored == tuple(
+            getattr(instance, name) for name in readmodels.AUTHOR_COLUMNS):
+        return
+    touch_recipes(Recipe.objects.filter(author=instance))
+    transaction.on_commit(lambda: cache.bump_recipes_version(instance.pk))
+
+
+@receiver(post_save, sender=Recipe)
+def record_saved_recipe(sender, instance, created, **kwargs):
+    """Запись через API, админку или ORM пересобирает документ."""
+    readmodels.record_changes([instance.pk])
+    readmodels.rebuild_on_commit([instance.pk])
+    transaction.on_commit(lambda: events.publish_recipe(
+        instance.pk, instance.author_id,
+        'created' if created else 'updated'))
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def rebuild_recipe_ingredients(sender, instance, **kwargs):
+    """Ингредиенты меняются и без сохранения рецепта, например в инлайне
+    админки."""
+    readmodels.rebuild_on_commit([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def rebuild_recipe_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        readmodels.rebuild_on_commit([instance.pk])
+    elif pk_set:
+        readmodels.rebuild_on_commit(pk_set)
+
+
+@receiver(post_delete, sender=Recipe)
+def record_deleted_recipe(sender, instance, **kwargs):
+    """Удаленный рецепт остается в журнале надгробием. Для рецепта,
+    удаленного через DeletionJob, запись сделана при отметке."""
+    if instance.deleted_at is None:
+        readmodels.record_changes([instance.pk], RecipeChange.DELETED)
+
+
+def touch_recipes(recipes):
+    """
+    Представление рецептов изменилось без сохранения самих рецептов:
+    документы пересобираются, дата изменения и журнал обновляются.
+    """
+    recipes.update(updated_at=timezone.now())
+    readmodels.rebuild_documents_for(recipes)
+    readmodels.record_changes(recipes.values_list('id', flat=True))
+
+
+def get_catalog_recipes(instance):
+    if isinstance(instance, Tag):
+        return Recipe.objects.filter(tags=instance)
+    return Recipe.objects.filter(ingredients=instance)
@@ -0,0 +1,1407 @@
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from foodgram import db_router, events, metrics
+from foodgram.constants import DICT_ERRORS
+from foodgram.querylog import NPlusOneError, QueryInspector
+from recipes import catalog
+from recipes.models import (BuyRecipe, DeletionJob, FavoriteRecipe,
+                            Ingredient, IngredientRecipe, Recipe,
+                            RecipeDocument, Tag)
+from users.models import Follow, User
+from . import cache as api_cache, corpus, deletion, readmodels
+from .management.commands import gc_media
+from .authentication import token_cache
+from .serializers import RecipeGetSerializer
+
+THREADS = 8
+PNG = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJ'
+       'AAAADUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg==')
+
+
+def run_concurrently(call, threads=THREADS):
+    """Запускает call одновременно в threads потоках, результаты
+    в порядке потоков. У каждого потока свое соединение с базой."""
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        barrier.wait()
+        try:
+            return call()
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(threads) as executor:
+        futures = [executor.submit(worker) for _ in range(threads)]
+        return [future.result(timeout=10) for future in futures]
+
+
+def create_recipe(author, name='Рецепт'):
+    return Recipe.objects.create(author=author, name=name,
+                                 image='recipes/images/recipe.png',
+                                 text='Описание', cooking_time=10)
+
+
+def use_catalog_snapshot(test, directory):
+    """Снимок справочника на время теста во временном каталоге."""
+    path = os.path.join(directory, 'ingredients')
+    snapshot = override_settings(CATALOG_SNAPSHOT_PATH=path)
+    snapshot.enable()
+    test.addCleanup(snapshot.disable)
+    # Снимок процесса не должен пережить временный каталог.
+    loaded = mock.patch.multiple(catalog, _snapshot=None, _checked_at=0)
+    loaded.start()
+    test.addCleanup(loaded.stop)
+    return path
+
+
+@override_settings(SINGLE_FLIGHT_LEASE=5, SINGLE_FLIGHT_POLL=0.01,
+                   SINGLE_FLIGHT_BETA=0)
+class SingleFlightTests(TransactionTestCase):
+    """Одновременные запросы одного ключа из нескольких потоков."""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+
+    def count_call(self):
+        with self.calls_lock:
+            self.calls += 1
+
+    def test_compute_runs_once(self):
+        def compute():
+            self.count_call()
+            time.sleep(0.2)
+            return 'value'
+
+        results = run_concurrently(
+            lambda: api_cache.single_flight('key', compute, 60))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['value'] * THREADS)
+        self.assertEqual(
+            api_cache.single_flight('key', compute, 60), 'value')
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_while_recomputing(self):
+        """Пока один поток пересчитывает новую версию, остальные сразу
+        получают значение предыдущей версии из stale_key."""
+        cache.set('key', ('old', time.time() + 60, 0.01), None)
+        released = threading.Event()
+
+        def compute():
+            self.count_call()
+            released.wait(10)
+            return 'new'
+
+        def call():
+            result = api_cache.single_flight('key:2', compute, 60,
+                                             stale_key='key')
+            if result == 'old':
+                with self.calls_lock:
+                    self.stale += 1
+                    if self.stale == THREADS - 1:
+                        released.set()
+            return result
+
+        self.stale = 0
+        results = run_concurrently(call)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(results), ['new'] + ['old'] * (THREADS - 1))
+        self.assertEqual(cache.get('key:2')[0], 'new')
+        self.assertEqual(cache.get('key')[0], 'new')
+
+    def test_uncacheable_result_is_not_stored(self):
+        def compute():
+            self.count_call()
+            raise api_cache.Uncacheable('error')
+
+        for _ in range(2):
+            with self.assertRaises(api_cache.Uncacheable):
+                api_cache.single_flight('key', compute, 60)
+        self.assertEqual(self.calls, 2)
+        self.assertIsNone(cache.get('key'))
+        self.assertIsNone(cache.get('key:lock'))
+
+
+class RecipeDocumentTests(TransactionTestCase):
+    """Ленивая сборка документов параллельными запросами."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.recipe = create_recipe(self.author)
+        RecipeDocument.objects.all().delete()
+
+    def test_concurrent_lazy_builds(self):
+        results = run_concurrently(
+            lambda: readmodels.get_documents([self.recipe.pk]))
+        self.assertEqual(RecipeDocument.objects.count(), 1)
+        payload = RecipeDocument.objects.get().payload
+        self.assertEqual(results, [{self.recipe.pk: payload}] * THREADS)
+
+    def test_lazy_build_keeps_existing_document(self):
+        RecipeDocument.objects.create(recipe=self.recipe,
+                                      payload={'name': 'Новое'})
+        readmodels.create_documents([self.recipe.pk])
+        self.assertEqual(RecipeDocument.objects.get().payload,
+                         {'name': 'Новое'})
+
+
+class SparseFieldsTests(TestCase):
+    """Усеченные рецепты без id для авторизованного пользователя."""
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.recipe = create_recipe(author)
+        user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_fields_without_id(self):
+        for params, keys in (
+            ({'fields': 'name'}, ['name']),
+            ({'fields': 'author'}, ['author']),
+            ({'fields': 'is_favorited'}, ['is_favorited']),
+            ({'fields': 'id,name'}, ['id', 'name']),
+        ):
+            for url, extra, get_recipe in (
+                ('/api/recipes/', {}, lambda data: data['results'][0]),
+                (f'/api/recipes/{self.recipe.pk}/', {}, lambda data: data),
+                ('/api/recipes/', {'ids': self.recipe.pk},
+                 lambda data: data[0]),
+            ):
+                with self.subTest(url=url, **params, **extra):
+                    response = self.client.get(url, {**params, **extra})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(sorted(get_recipe(response.json())),
+                                     keys)
+
+    def test_omit_id(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/',
+                                   {'omit': 'id'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('id', response.json())
+        self.assertEqual(response.json()['name'], self.recipe.name)
+
+
+class ToggleConcurrencyTests(TransactionTestCase):
+    """
+    Одновременные добавления и удаления избранного, покупок и подписок
+    одним пользователем: ровно один запрос меняет строку, остальные
+    получают 400, а не 500 из-за IntegrityError.
+    """
+    rounds = 5
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.recipe = create_recipe(self.author)
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+
+    def request(self, method, url):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return getattr(client, method)(url).status_code
+
+    def assert_one_changed(self, statuses):
+        self.assertEqual(statuses.count(400), THREADS - 1, statuses)
+        self.assertLess(min(statuses), 300, statuses)
+
+    def race(self, url, model, values):
+        for _ in range(self.rounds):
+            self.assert_one_changed(
+                run_concurrently(lambda: self.request('post', url)))
+            self.assertEqual(model.objects.filter(**values).count(), 1)
+            self.assert_one_changed(
+                run_concurrently(lambda: self.request('delete', url)))
+            self.assertFalse(model.objects.filter(**values).exists())
+
+    def test_favorite(self):
+        self.race(f'/api/recipes/{self.recipe.pk}/favorite/',
+                  FavoriteRecipe, {'user': self.user, 'recipe': self.recipe})
+
+    def test_shopping_cart(self):
+        self.race(f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+                  BuyRecipe, {'user': self.user, 'recipe': self.recipe})
+
+    def test_subscribe(self):
+        self.race(f'/api/users/{self.author.pk}/subscribe/',
+                  Follow, {'user': self.user, 'following': self.author})
+
+
+@override_settings(METRICS_FLUSH_INTERVAL=0)
+class MetricsTests(SimpleTestCase):
+    """Файлы метрик воркеров."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        settings = override_settings(METRICS_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.store = metrics.MetricsStore()
+
+    def read_counter(self, filename):
+        counters = defaultdict(float)
+        metrics._merge({}, counters, os.path.join(self.directory, filename))
+        return counters[('foodgram_test_total', ())]
+
+    def test_concurrent_flushes(self):
+        def flush():
+            for _ in range(20):
+                self.store.inc('foodgram_test_total')
+                self.store.flush()
+            return True
+
+        self.assertEqual(run_concurrently(flush), [True] * THREADS)
+        self.assertEqual(os.listdir(self.directory),
+                         [f'metrics-{os.getpid()}.json'])
+        self.assertEqual(self.read_counter(f'metrics-{os.getpid()}.json'),
+                         20 * THREADS)
+
+    def test_dead_worker_is_archived(self):
+        self.store.inc('foodgram_test_total', 3)
+        self.store.flush(force=True)
+        os.rename(os.path.join(self.directory,
+                               f'metrics-{os.getpid()}.json'),
+                  os.path.join(self.directory, 'metrics-1.json'))
+        metrics.mark_process_dead(1)
+        self.assertEqual(os.listdir(self.directory),
+                         ['metrics-archive.json'])
+        self.assertEqual(self.read_counter('metrics-archive.json'), 3)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class QueryInspectorTests(TestCase):
+    """Поиск N+1 в режиме raise, включенном в тестах."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_repeated_queries_raise(self):
+        inspector = QueryInspector()
+        with connection.execute_wrapper(inspector):
+            for pk in range(settings.QUERY_INSPECTOR_REPEAT_THRESHOLD):
+                Tag.objects.filter(pk=pk).exists()
+        with self.assertRaises(NPlusOneError):
+            inspector.report('view')
+
+    def test_lazy_objects_are_not_evaluated(self):
+        # Кадр вне пакетов приложений, как у request.user в админке.
+        namespace = {}
+        exec(compile('def query(self, queryset):\n    queryset.exists()',
+                     '<lazy>', 'exec'), namespace)
+        inspector = QueryInspector()
+        user = SimpleLazyObject(lambda: User.objects.get(pk=self.user.pk))
+        with connection.execute_wrapper(inspector):
+            namespace['query'](user, Tag.objects.all())
+        self.assertEqual(sum(inspector.fingerprints.values()), 1)
+        self.assertEqual(inspector.repeated(), [])
+
+    def test_create_recipe_with_many_ingredients(self):
+        self.assertEqual(settings.QUERY_INSPECTOR_MODE, 'raise')
+        tag = Tag.objects.create(name='Завтрак', color='#FF0000',
+                                 slug='breakfast')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(10))
+        ingredients = Ingredient.objects.all()
+        response = self.client.post('/api/recipes/', {
+            'tags': [tag.pk],
+            'ingredients': [{'id': ingredient.pk, 'amount': index + 1}
+                            for index, ingredient in enumerate(ingredients)],
+            'name': 'Рецепт',
+            'image': PNG,
+            'text': 'Описание',
+            'cooking_time': 10,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(len(response.json()['ingredients']), 10)
+        response = self.client.patch(
+            f'/api/recipes/{response.json()["id"]}/', {
+                'tags': [tag.pk],
+                'ingredients': [{'id': ingredient.pk, 'amount': 5}
+                                for ingredient in ingredients[:6]],
+                'name': 'Рецепт',
+                'text': 'Описание',
+                'cooking_time': 10,
+            }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([item['amount']
+                          for item in response.json()['ingredients']],
+                         [5] * 6)
+
+    def test_unknown_ingredient(self):
+        tag = Tag.objects.create(name='Завтрак', color='#FF0000',
+                                 slug='breakfast')
+        response = self.client.post('/api/recipes/', {
+            'tags': [tag.pk],
+            'ingredients': [{'id': 100500, 'amount': 1}],
+            'name': 'Рецепт',
+            'image': PNG,
+            'text': 'Описание',
+            'cooking_time': 10,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PROFILE_ENABLED=True, PROFILE_SAMPLE_RATE=0)
+class ProfilingTests(TestCase):
+    """Профилирование по X-Profile только для администратора."""
+
+    def setUp(self):
+        profile_dir = override_settings(PROFILE_DIR=tempfile.mkdtemp())
+        profile_dir.enable()
+        self.addCleanup(profile_dir.disable)
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_header_ignored_for_anonymous_and_users(self):
+        for client in (APIClient(), self.client):
+            response = client.get('/api/tags/', HTTP_X_PROFILE='1')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(settings.PROFILE_DIR), [])
+
+    def test_staff_token_is_profiled(self):
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/tags/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(response['X-Profile-Id'],
+                      os.listdir(settings.PROFILE_DIR))
+
+
+@override_settings(DATABASE_REPLICAS={'replica': 1})
+class ReplicaRouterTests(TransactionTestCase):
+    """Чтение из реплики (отдельный файл SQLite) и отказ реплики."""
+
+    def setUp(self):
+        cache.clear()
+        self.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                      slug='breakfast')
+        path = os.path.join(tempfile.mkdtemp(), 'replica.sqlite3')
+        with sqlite3.connect(connection.settings_dict['NAME']) as source, \
+                sqlite3.connect(path) as target:
+            source.backup(target)
+        connections.databases['replica'] = dict(
+            connection.settings_dict, NAME=path)
+        self.addCleanup(self.drop_replica)
+        self.replica = path
+        Tag.objects.filter(pk=self.tag.pk).update(name='Обед')
+
+    def drop_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        db_router._down_until.clear()
+
+    def get_name(self):
+        response = APIClient().get(f'/api/tags/{self.tag.pk}/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['name']
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.get_name(), 'Завтрак')
+
+    def test_failed_replica_falls_back_to_primary(self):
+        self.assertEqual(self.get_name(), 'Завтрак')
+        with sqlite3.connect(self.replica) as replica:
+            replica.execute('DROP TABLE recipes_tag')
+        self.assertEqual(self.get_name(), 'Обед')
+        self.assertIn('replica', db_router._down_until)
+        self.assertEqual(self.get_name(), 'Обед')
+
+
+@override_settings(CACHE_IS_SHARED=True)
+class TokenCacheTests(TestCase):
+    """Кеш токенов сбрасывается при выходе и смене пароля."""
+
+    def setUp(self):
+        cache.clear()
+        token_cache._entries.clear()
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def count_token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/me/')
+        return response, sum('authtoken_token' in query['sql']
+                             for query in queries.captured_queries)
+
+    def test_known_token_skips_database(self):
+        self.assertEqual(self.count_token_queries()[1], 1)
+        response, count = self.count_token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(count, 0)
+
+    def test_logout_invalidates_token(self):
+        self.count_token_queries()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        response, count = self.count_token_queries()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(count, 1)
+
+    def test_password_change_invalidates_user(self):
+        self.count_token_queries()
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'pass', 'new_password': 'Nov0e-parol'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.count_token_queries()[1], 1)
+
+    def test_deactivated_user_is_rejected(self):
+        self.count_token_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.count_token_queries()[0].status_code, 401)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ResponseCacheTests(TestCase):
+    """Кеш страниц списка рецептов для анонимных пользователей."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.tag = Tag.objects.create(name='Завтрак', color='#FF0000',
+                                      slug='breakfast')
+        self.recipe = create_recipe(self.author)
+        self.recipe.tags.add(self.tag)
+        self.client = APIClient()
+
+    def get_names(self, params=None):
+        response = self.client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.json()['results']]
+
+    def test_anonymous_page_is_cached(self):
+        self.assertEqual(self.get_names(), ['Рецепт'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_names({'page': 1}), ['Рецепт'])
+
+    def test_recipe_change_invalidates_page(self):
+        self.get_names()
+        self.get_names({'author': self.author.pk})
+        ingredient = Ingredient.objects.create(name='Соль',
+                                               measurement_unit='г')
+        author = APIClient()
+        author.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = author.patch(f'/api/recipes/{self.recipe.pk}/', {
+                'tags': [self.tag.pk],
+                'ingredients': [{'id': ingredient.pk, 'amount': 1}],
+                'name': 'Новое название',
+                'text': 'Описание',
+                'cooking_time': 10,
+            }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.get_names(), ['Новое название'])
+        self.assertEqual(self.get_names({'author': self.author.pk}),
+                         ['Новое название'])
+
+    def test_tag_change_invalidates_page(self):
+        self.get_names({'tags': 'breakfast'})
+        self.tag.name = 'Обед'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.save()
+        response = self.client.get('/api/recipes/', {'tags': 'breakfast'})
+        self.assertEqual(response.json()['results'][0]['tags'][0]['name'],
+                         'Обед')
+
+
+class TagsFilterTests(TestCase):
+    """Фильтр рецептов по слагам тегов."""
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        breakfast = Tag.objects.create(name='Завтрак', color='#FF0000',
+                                       slug='breakfast')
+        lunch = Tag.objects.create(name='Обед', color='#00FF00',
+                                   slug='lunch')
+        create_recipe(author, 'Каша').tags.add(breakfast)
+        create_recipe(author, 'Суп').tags.add(lunch)
+        create_recipe(author, 'Омлет').tags.add(breakfast, lunch)
+
+    def get_names(self, tags):
+        response = APIClient().get('/api/recipes/', {'tags': tags})
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(recipe['name'] for recipe in response.json()['results'])
+
+    def test_known_slugs(self):
+        self.assertEqual(self.get_names(['breakfast']), ['Каша', 'Омлет'])
+        self.assertEqual(self.get_names(['breakfast', 'lunch']),
+                         ['Каша', 'Омлет', 'Суп'])
+
+    def test_unknown_slug_gives_empty_page(self):
+        self.assertEqual(self.get_names(['dinner']), [])
+        self.assertEqual(self.get_names(['dinner', 'lunch']),
+                         ['Омлет', 'Суп'])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeFragmentsTests(TestCase):
+    """build_fragments с флагами совпадает с RecipeGetSerializer."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        self.recipe = create_recipe(self.author)
+        self.recipe.tags.add(
+            Tag.objects.create(name='Обед', color='#00FF00', slug='lunch'),
+            Tag.objects.create(name='Завтрак', color='#FF0000',
+                               slug='breakfast'))
+        for index, name in enumerate(('Соль', 'Мука')):
+            IngredientRecipe.objects.create(
+                recipe=self.recipe, amount=index + 1,
+                ingredient=Ingredient.objects.create(
+                    name=name, measurement_unit='г'))
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        BuyRecipe.objects.create(user=self.user, recipe=self.recipe)
+        Follow.objects.create(user=self.user, following=self.author)
+
+    def get_request(self, user):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        return request
+
+    def test_fragments_match_serializer(self):
+        for user in (AnonymousUser(), self.user, self.author):
+            request = self.get_request(user)
+            expected = json.loads(json.dumps(RecipeGetSerializer(
+                self.recipe, context={'request': request}).data))
+            for fields in (readmodels.RECIPE_FIELDS,
+                           ('author', 'is_favorited'),
+                           ('tags', 'ingredients', 'image'),
+                           ('id', 'is_in_shopping_cart', 'cooking_time')):
+                with self.subTest(user=str(user), fields=fields):
+                    fragments = readmodels.build_fragments(
+                        [self.recipe.pk], fields)
+                    recipes = readmodels.apply_user_flags(
+                        [fragments[self.recipe.pk]], request, fields)
+                    self.assertEqual(recipes, [{
+                        name: expected[name] for name in fields}])
+
+
+class RecipeDocumentSignalTests(TransactionTestCase):
+    """Документ и кеш обновляются при записи рецепта мимо API."""
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.recipe = create_recipe(author)
+        self.client = APIClient()
+
+    def get_recipe(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_orm_edits_reach_api(self):
+        self.assertEqual(self.get_recipe()['name'], 'Рецепт')
+        self.recipe.name = 'Новое название'
+        self.recipe.save()
+        self.assertEqual(self.get_recipe()['name'], 'Новое название')
+
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, amount=3,
+            ingredient=Ingredient.objects.create(name='Соль',
+                                                 measurement_unit='г'))
+        self.assertEqual(
+            [item['name'] for item in self.get_recipe()['ingredients']],
+            ['Соль'])
+
+        self.recipe.tags.add(Tag.objects.create(
+            name='Завтрак', color='#FF0000', slug='breakfast'))
+        self.assertEqual([tag['slug'] for tag in self.get_recipe()['tags']],
+                         ['breakfast'])
+        self.assertEqual(
+            RecipeDocument.objects.get(recipe=self.recipe).payload['name'],
+            'Новое название')
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.json()['results'][0]['tags'][0]['slug'],
+                         'breakfast')
+
+    def test_transaction_rebuilds_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                self.recipe.name = 'Новое название'
+                self.recipe.save()
+                self.recipe.tags.add(Tag.objects.create(
+                    name='Завтрак', color='#FF0000', slug='breakfast'))
+        self.assertEqual(sum('DELETE FROM "recipes_recipedocument"'
+                             in query['sql']
+                             for query in queries.captured_queries), 1)
+
+
+class BulkLinkTests(TestCase):
+    """Избранное, покупки и подписки списком ids одним запросом."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        self.first = create_recipe(self.author, 'Каша')
+        self.second = create_recipe(self.author, 'Суп')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_statuses(self, method, url, ids):
+        response = getattr(self.client, method)(url, {'ids': ids},
+                                                format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return {item['id']: item['status']
+                for item in response.json()['results']}
+
+    def test_favorite_add_and_remove(self):
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.first)
+        ids = [self.first.pk, self.second.pk, 100500]
+        self.assertEqual(
+            self.get_statuses('post', '/api/recipes/favorite/', ids),
+            {self.first.pk: 'exists', self.second.pk: 'created',
+             100500: 'not_found'})
+        self.assertEqual(FavoriteRecipe.objects.filter(
+            user=self.user).count(), 2)
+        self.assertEqual(
+            self.get_statuses('delete', '/api/recipes/favorite/',
+                              [self.second.pk, 100500]),
+            {self.second.pk: 'deleted', 100500: 'missing'})
+        self.assertEqual(list(FavoriteRecipe.objects.filter(
+            user=self.user).values_list('recipe', flat=True)),
+            [self.first.pk])
+
+    def test_shopping_cart_replace(self):
+        BuyRecipe.objects.create(user=self.user, recipe=self.first)
+        response = self.client.put('/api/recipes/shopping_cart/',
+                                   {'ids': [self.second.pk]}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['removed'], [self.first.pk])
+        self.assertEqual(list(BuyRecipe.objects.filter(
+            user=self.user).values_list('recipe', flat=True)),
+            [self.second.pk])
+
+    def test_subscribe_excludes_self(self):
+        self.assertEqual(
+            self.get_statuses('post', '/api/users/subscribe/',
+                              [self.author.pk, self.user.pk]),
+            {self.author.pk: 'created', self.user.pk: 'forbidden'})
+        self.assertTrue(Follow.objects.filter(
+            user=self.user, following=self.author).exists())
+        self.assertEqual(
+            self.get_statuses('delete', '/api/users/subscribe/',
+                              [self.author.pk]),
+            {self.author.pk: 'deleted'})
+        self.assertFalse(Follow.objects.exists())
+
+    def test_anonymous_rejected(self):
+        response = APIClient().post('/api/recipes/favorite/',
+                                    {'ids': [self.first.pk]}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class ToggleErrorsTests(TestCase):
+    """Ошибки добавления связей в формате non_field_errors."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        self.recipe = create_recipe(self.author)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_error(self, url, key):
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {
+            'non_field_errors': [str(DICT_ERRORS.get(key))]})
+
+    def test_duplicate_favorite_and_cart(self):
+        for url in (f'/api/recipes/{self.recipe.pk}/favorite/',
+                    f'/api/recipes/{self.recipe.pk}/shopping_cart/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.post(url).status_code, 201)
+                self.assert_error(url, 're-recipe')
+
+    def test_duplicate_subscription(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assert_error(url, 're-subscription')
+
+    def test_subscribe_to_myself(self):
+        self.assert_error(f'/api/users/{self.user.pk}/subscribe/',
+                          'subscribe_to_myself')
+
+
+class RecipeIdsTests(TestCase):
+    """Рецепты по ?ids= в переданном порядке."""
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        tag = Tag.objects.create(name='Завтрак', color='#FF0000',
+                                 slug='breakfast')
+        ingredient = Ingredient.objects.create(name='Соль',
+                                               measurement_unit='г')
+        self.recipes = []
+        for name in ('Каша', 'Суп', 'Омлет'):
+            recipe = create_recipe(author, name)
+            recipe.tags.add(tag)
+            IngredientRecipe.objects.create(recipe=recipe,
+                                            ingredient=ingredient, amount=1)
+            self.recipes.append(recipe)
+        user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        FavoriteRecipe.objects.create(user=user, recipe=self.recipes[1])
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_requested_order_and_missing_ids(self):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        ids = f'{third},100500,{first},{second}'
+        response = self.client.get('/api/recipes/', {'ids': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([recipe['id'] for recipe in response.json()],
+                         [third, first, second])
+        self.assertEqual([recipe['is_favorited']
+                          for recipe in response.json()],
+                         [False, False, True])
+
+    def test_one_query_per_type(self):
+        ids = ','.join(str(recipe.pk) for recipe in self.recipes)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/', {'ids': ids})
+        self.assertEqual(response.status_code, 200)
+        tables = defaultdict(int)
+        for query in queries.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                tables[query['sql'].split(' FROM ')[1].split()[0]] += 1
+        self.assertTrue(tables)
+        self.assertEqual(set(tables.values()), {1}, tables)
+
+
+@override_settings(CHANGES_SETTLE_SECONDS=0)
+class AuthorChangesTests(TransactionTestCase):
+    """Рецепты автора пересобираются только при смене выводимых полей."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.recipe = create_recipe(self.author)
+        self.cursor = self.get_changes(0)['cursor']
+
+    def get_changes(self, since):
+        response = APIClient().get('/api/recipes/changes/', {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_unrendered_fields_keep_recipes(self):
+        self.author.is_staff = True
+        self.author.set_password('new-pass')
+        self.author.save()
+        self.author.last_login = timezone.now()
+        self.author.save(update_fields=['last_login'])
+        self.assertEqual(self.get_changes(self.cursor)['results'], [])
+
+    def test_rendered_field_rebuilds_recipes(self):
+        self.author.first_name = 'Повар'
+        self.author.save()
+        changes = self.get_changes(self.cursor)
+        self.assertEqual([(item['id'], item['action'])
+                          for item in changes['results']],
+                         [(self.recipe.pk, 'updated')])
+        self.assertEqual(
+            changes['results'][0]['recipe']['author']['first_name'], 'Повар')
+        self.assertEqual(self.get_changes(changes['cursor'])['results'], [])
+
+
+class ConditionalTests(TestCase):
+    """304 по If-None-Match и If-Modified-Since до сборки ответа."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.recipe = create_recipe(self.author)
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_anonymous_validators(self):
+        client = APIClient()
+        response = client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        self.recipe.updated_at += timedelta(seconds=5)
+        self.recipe.save(update_fields=['updated_at'])
+        response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_user_flags_change_etag(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code,
+            304)
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_favorited'])
+
+    def test_profile_etag(self):
+        url = f'/api/users/{self.author.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Follow.objects.create(user=self.user, following=self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_subscribed'])
+
+
+class EventsTests(TransactionTestCase):
+    """Поток событий /api/events/ только по токену из заголовка."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        self.token = Token.objects.create(user=self.user)
+
+    def call(self, headers=(), method='GET', query_string=b'', react=None):
+        """Вызывает events_app, react(message) отвечает на отправленное
+        сообщение новым входящим сообщением или None."""
+        async def run():
+            incoming = asyncio.Queue()
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+                reply = react and react(message)
+                if reply is not None:
+                    await incoming.put(reply)
+
+            await asyncio.wait_for(events.events_app({
+                'type': 'http', 'method': method,
+                'path': settings.EVENTS_PATH, 'query_string': query_string,
+                'headers': list(headers),
+            }, incoming.get, send), 5)
+            return sent
+
+        return asyncio.run(run())
+
+    def test_unauthenticated_requests(self):
+        for headers, query_string in (
+            ((), b''),
+            ((), f'token={self.token.key}'.encode()),
+            (((b'authorization', b'Token unknown'),), b''),
+            (((b'authorization', self.token.key.encode()),), b''),
+        ):
+            with self.subTest(headers=headers, query_string=query_string):
+                sent = self.call(headers, query_string=query_string)
+                self.assertEqual(sent[0]['status'], 401)
+        sent = self.call(method='POST')
+        self.assertEqual(sent[0]['status'], 405)
+
+    def test_event_stream(self):
+        event = {'event': 'recipe',
+                 'data': {'id': 1, 'author': 2, 'action': 'created'}}
+
+        def react(message):
+            if message.get('body') == b': connected\n\n':
+                events.broker.publish({self.user.pk}, event)
+            elif message.get('body', b'').startswith(b'event:'):
+                return {'type': 'http.disconnect'}
+            return None
+
+        sent = self.call(((b'authorization',
+                           f'Token {self.token.key}'.encode()),),
+                         react=react)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(sent[-1]['body'], events.format_event(event))
+        self.assertEqual(events.broker.listeners(), set())
+
+
+@override_settings(CATALOG_SNAPSHOT_CHECK=0)
+class BootstrapTests(TransactionTestCase):
+    """Повторный bootstrap ничего не меняет."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        use_catalog_snapshot(self, directory)
+        self.seed = os.path.join(directory, 'seed.json')
+        with open(self.seed, 'w') as f:
+            json.dump({
+                'admin': {'username': 'admin', 'email': 'admin@example.com',
+                          'first_name': 'Админ', 'last_name': 'Сайта'},
+                'tags': [{'name': 'Завтрак', 'color': '#FF0000',
+                          'slug': 'breakfast'}],
+                'ingredients': [
+                    {'name': 'Соль', 'measurement_unit': 'г'},
+                    {'name': 'Мука', 'measurement_unit': 'г'},
+                    {'name': 'Соль', 'measurement_unit': 'г'},
+                ],
+            }, f)
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.recipe = create_recipe(author)
+        RecipeDocument.objects.all().delete()
+
+    def bootstrap(self):
+        with mock.patch.dict(os.environ, ADMIN_PASSWORD='admin-pass'):
+            with CaptureQueriesContext(connection) as queries:
+                call_command('bootstrap', self.seed, stdout=io.StringIO())
+        return [query['sql'] for query in queries.captured_queries
+                if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+
+    def test_second_run_writes_nothing(self):
+        self.assertTrue(self.bootstrap())
+        admin = User.objects.get(username='admin')
+        self.assertTrue(admin.is_superuser and admin.check_password(
+            'admin-pass'))
+        self.assertEqual(Tag.objects.get().slug, 'breakfast')
+        self.assertEqual(Ingredient.objects.count(), 2)
+        self.assertTrue(RecipeDocument.objects.filter(
+            recipe=self.recipe).exists())
+        self.assertEqual(len(catalog.get_snapshot()), 2)
+        self.assertEqual(self.bootstrap(), [])
+        self.assertEqual(User.objects.filter(username='admin').count(), 1)
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+    def test_changed_tag_is_updated(self):
+        self.bootstrap()
+        Tag.objects.update(color='#000000')
+        writes = self.bootstrap()
+        self.assertTrue(writes)
+        self.assertEqual(Tag.objects.get().color, '#FF0000')
+        self.assertEqual(self.bootstrap(), [])
+
+
+@override_settings(CATALOG_SNAPSHOT_CHECK=0)
+class CatalogSnapshotTests(TransactionTestCase):
+    """Снимок справочника ингредиентов пересобирается после коммита."""
+
+    def setUp(self):
+        cache.clear()
+        self.path = use_catalog_snapshot(self, tempfile.mkdtemp())
+
+    def search(self, name):
+        response = APIClient().get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [(item['name'], item['measurement_unit'])
+                for item in response.json()]
+
+    def test_rebuild_on_commit(self):
+        with transaction.atomic():
+            for name in ('Сахар', 'соль', 'Сода', 'Мука'):
+                Ingredient.objects.create(name=name, measurement_unit='г')
+            self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(len(catalog.get_snapshot()), 4)
+        self.assertEqual(self.search('с'),
+                         [('Сахар', 'г'), ('Сода', 'г'), ('соль', 'г')])
+        self.assertEqual(self.search('СО'), [('Сода', 'г'), ('соль', 'г')])
+
+        salt = Ingredient.objects.get(name='соль')
+        salt.measurement_unit = 'кг'
+        salt.save()
+        response = APIClient().get(f'/api/ingredients/{salt.pk}/')
+        self.assertEqual(response.json(), {
+            'id': salt.pk, 'name': 'соль', 'measurement_unit': 'кг'})
+        salt.delete()
+        self.assertEqual(self.search('со'), [('Сода', 'г')])
+
+    def test_build_command(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(3))
+        self.assertIsNone(catalog.get_snapshot())
+        call_command('build_catalog', stdout=io.StringIO())
+        snapshot = catalog.get_snapshot()
+        self.assertEqual([item['name'] for item in snapshot.search()],
+                         ['Ингредиент 0', 'Ингредиент 1', 'Ингредиент 2'])
+        pk = Ingredient.objects.get(name='Ингредиент 1').pk
+        self.assertEqual(snapshot.get(pk)['name'], 'Ингредиент 1')
+        self.assertIsNone(snapshot.get(100500))
+
+
+class CorpusTests(TransactionTestCase):
+    """Перенос данных export_corpus -> import_corpus."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        use_catalog_snapshot(self, directory)
+        self.path = os.path.join(directory, 'corpus.ndjson.gz')
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        reader = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        tag = Tag.objects.create(name='Завтрак', color='#FF0000',
+                                 slug='breakfast')
+        for name in ('Каша', 'Суп'):
+            recipe = create_recipe(author, name)
+            recipe.tags.add(tag)
+            IngredientRecipe.objects.create(
+                recipe=recipe, amount=len(name),
+                ingredient=Ingredient.objects.get_or_create(
+                    name='Соль', measurement_unit='г')[0])
+        Follow.objects.create(user=reader, following=author)
+        FavoriteRecipe.objects.create(user=reader, recipe=recipe)
+        BuyRecipe.objects.create(user=reader, recipe=recipe)
+        self.expected = self.get_corpus()
+        call_command('export_corpus', self.path, stderr=io.StringIO())
+
+    @staticmethod
+    def get_corpus():
+        """Данные без первичных ключей, которые при переносе меняются."""
+        return {name: sorted(queryset) for name, queryset in (
+            ('users', User.objects.values_list('email', 'username',
+                                               'password')),
+            ('tags', Tag.objects.values_list('slug', 'name', 'color')),
+            ('ingredients', Ingredient.objects.values_list(
+                'name', 'measurement_unit')),
+            ('recipes', Recipe.objects.values_list(
+                'author__email', 'name', 'pub_date')),
+            ('recipe_tags', Recipe.tags.through.objects.values_list(
+                'recipe__name', 'tag__slug')),
+            ('recipe_ingredients', IngredientRecipe.objects.values_list(
+                'recipe__name', 'ingredient__name', 'amount')),
+            ('follows', Follow.objects.values_list(
+                'user__email', 'following__email')),
+            ('favorites', FavoriteRecipe.objects.values_list(
+                'user__email', 'recipe__name')),
+            ('carts', BuyRecipe.objects.values_list(
+                'user__email', 'recipe__name')),
+        )}
+
+    def clear(self):
+        User.objects.all().delete()
+        Tag.objects.all().delete()
+        Ingredient.objects.all().delete()
+
+    def load(self, *args):
+        call_command('import_corpus', self.path, '--batch-size', '1', *args,
+                     stderr=io.StringIO())
+
+    def test_round_trip(self):
+        self.clear()
+        self.load()
+        self.assertEqual(self.get_corpus(), self.expected)
+        self.assertEqual(RecipeDocument.objects.count(), 2)
+        self.assertEqual(len(catalog.get_snapshot()), 1)
+
+    def test_repeated_import_adds_nothing(self):
+        self.load()
+        self.load('--restart')
+        self.assertEqual(self.get_corpus(), self.expected)
+
+    def test_resume_after_failure(self):
+        self.clear()
+        import_rows = corpus.import_rows
+
+        def fail_on_favorites(section, rows, state):
+            if section.name == 'favorite':
+                raise IntegrityError('прервано')
+            return import_rows(section, rows, state)
+
+        with mock.patch.object(corpus, 'import_rows', fail_on_favorites):
+            with self.assertRaises(CommandError):
+                self.load()
+        self.assertFalse(FavoriteRecipe.objects.exists())
+        self.assertTrue(Follow.objects.exists())
+        with mock.patch.object(corpus, 'import_rows',
+                               wraps=import_rows) as resumed:
+            self.load()
+        self.assertEqual({call.args[0].name for call in resumed.mock_calls},
+                         {'favorite', 'cart'})
+        self.assertEqual(self.get_corpus(), self.expected)
+
+
+class Crash(BaseException):
+    """Остановка процесса посреди задачи: обработчики Exception ее
+    не перехватывают."""
+
+
+class DeletionJobTests(TransactionTestCase):
+    """Задачи удаления: один исполнитель и продолжение после сбоя."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        reader = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass')
+        for index in range(3):
+            recipe = create_recipe(self.author, f'Рецепт {index}')
+            FavoriteRecipe.objects.create(user=reader, recipe=recipe)
+        Follow.objects.create(user=reader, following=self.author)
+
+    def test_single_claim(self):
+        deletion.tombstone_user(self.author)
+        claimed = [job for job in run_concurrently(deletion.claim_job)
+                   if job is not None]
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claimed[0].status, DeletionJob.RUNNING)
+        self.assertIsNone(deletion.claim_job())
+
+    def test_stale_job_is_resumed(self):
+        job = deletion.tombstone_user(self.author)
+        self.assertFalse(User.objects.filter(pk=self.author.pk).exists())
+        self.assertFalse(Recipe.objects.exists())
+        reports = []
+
+        def crash(job):
+            reports.append(job.step)
+            if len(reports) == 2:
+                raise Crash
+
+        with self.assertRaises(Crash):
+            deletion.run_job(deletion.claim_job(), 1, crash)
+        self.assertEqual(reports, ['recipe_favorites', 'recipes'])
+        self.assertEqual(Recipe.all_objects.count(), 2)
+        self.assertEqual(FavoriteRecipe.objects.count(), 2)
+        # Задача зависла в RUNNING и до таймаута не выдается повторно.
+        self.assertIsNone(deletion.claim_job())
+        DeletionJob.objects.update(
+            updated_at=timezone.now() - timedelta(
+                seconds=settings.DELETION_JOB_TIMEOUT + 1))
+        call_command('process_deletions', '--batch-size', '1',
+                     stdout=io.StringIO())
+
+        resumed = DeletionJob.objects.get()
+        self.assertEqual(resumed.pk, job.pk)
+        self.assertEqual(resumed.status, DeletionJob.DONE)
+        # 3 избранных, 3 рецепта, подписка и сам пользователь.
+        self.assertEqual(resumed.deleted, 8)
+        self.assertFalse(User.all_objects.filter(pk=self.author.pk).exists())
+        self.assertFalse(Recipe.all_objects.exists())
+        self.assertFalse(FavoriteRecipe.objects.exists())
+        self.assertFalse(Follow.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class GcMediaTests(TestCase):
+    """gc_media удаляет только старые файлы без ссылок."""
+
+    def setUp(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.storage = Recipe._meta.get_field('image').storage
+        self.names = {
+            key: self.storage.save('recipes/images/image.png',
+                                   ContentFile(key.encode()))
+            for key in ('used', 'orphan', 'young', 'uploaded')
+        }
+        self.addCleanup(self.remove_files)
+        Recipe.objects.create(author=author, name='Рецепт',
+                              image=self.names['used'], text='Описание',
+                              cooking_time=10)
+        old = time.time() - settings.MEDIA_GC_MIN_AGE - 60
+        for key in ('used', 'orphan', 'uploaded'):
+            os.utime(self.storage.path(self.names[key]), (old, old))
+
+    def remove_files(self):
+        for name in self.names.values():
+            self.storage.delete(name)
+
+    def test_collects_only_stale_orphans(self):
+        batches = gc_media.Command.batches
+
+        def reupload_during_check(files, size):
+            # Картинку загрузили заново после обхода каталога,
+            # рецепт с ней еще не сохранен.
+            for batch in batches(files, size):
+                self.storage.save('recipes/images/image.png',
+                                  ContentFile(b'uploaded'))
+                yield batch
+
+        with mock.patch.object(gc_media.Command, 'batches',
+                               staticmethod(reupload_during_check)):
+            call_command('gc_media', stdout=io.StringIO())
+        self.assertEqual(
+            {key for key, name in self.names.items()
+             if self.storage.exists(name)},
+            {'used', 'young', 'uploaded'})
+
+    def test_dry_run_keeps_files(self):
+        output = io.StringIO()
+        call_command('gc_media', '--dry-run', stdout=output)
+        self.assertIn('файлов без ссылок 2 из 3', output.getvalue())
+        self.assertTrue(all(self.storage.exists(name)
+                            for name in self.names.values()))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AdminTests(TestCase):
+    """Списки админки без запросов на строку, удаление отметкой."""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com',
+            first_name='Админ', last_name='Сайта', password='pass')
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        self.recipe = create_recipe(self.author)
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        start = User.objects.count()
+        for index in range(start, start + count):
+            user = User.objects.create_user(
+                username=f'user{index}', email=f'user{index}@example.com',
+                first_name='Читатель', last_name='Рецептов',
+                password='pass')
+            recipe = create_recipe(user, f'Рецепт {index}')
+            Follow.objects.create(user=user, following=self.author)
+            FavoriteRecipe.objects.create(user=user, recipe=recipe)
+            BuyRecipe.objects.create(user=user, recipe=self.recipe)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries)
+
+    def test_changelists_do_not_grow_with_rows(self):
+        urls = [f'/admin/{app}/{model}/' for app, model in (
+            ('users', 'user'), ('recipes', 'recipe'),
+            ('recipes', 'ingredient'), ('users', 'follow'),
+            ('recipes', 'favoriterecipe'), ('recipes', 'buyrecipe'),
+            ('recipes', 'deletionjob'))]
+        self.add_rows(1)
+        before = [self.count_queries(url) for url in urls]
+        self.add_rows(5)
+        self.assertEqual([self.count_queries(url) for url in urls], before)
+
+    def test_user_counts(self):
+        self.add_rows(3)
+        response = self.client.get('/admin/users/user/',
+                                   {'q': 'author@example.com'})
+        (user,) = response.context['cl'].result_list
+        self.assertEqual((user.follow_count, user.recipe_count), (3, 1))
+
+    def test_delete_is_tombstone(self):
+        response = self.client.post(
+            f'/admin/users/user/{self.author.pk}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(User.objects.filter(pk=self.author.pk).exists())
+        self.assertTrue(User.all_objects.filter(pk=self.author.pk).exists())
+        job = DeletionJob.objects.get()
+        self.assertEqual((job.kind, job.object_id, job.status),
+                         (DeletionJob.USER, self.author.pk,
+                          DeletionJob.PENDING))
+
+    def test_inline_edit_rebuilds_document(self):
+        ingredient = Ingredient.objects.create(name='Соль',
+                                               measurement_unit='г')
+        self.recipe.tags.add(Tag.objects.create(
+            name='Завтрак', color='#FF0000', slug='breakfast'))
+        url = f'/admin/recipes/recipe/{self.recipe.pk}/change/'
+        response = self.client.get(url)
+        form = response.context['adminform'].form
+        data = {name: form[name].value() for name in form.fields
+                if name != 'image' and form[name].value() is not None}
+        formset = response.context['inline_admin_formsets'][0].formset
+        prefix = formset.prefix
+        data.update({
+            'name': 'Новое название',
+            f'{prefix}-TOTAL_FORMS': 1,
+            f'{prefix}-INITIAL_FORMS': 0,
+            f'{prefix}-0-ingredient': ingredient.pk,
+            f'{prefix}-0-amount': 2,
+        })
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        recipe = APIClient().get(f'/api/recipes/{self.recipe.pk}/').json()
+        self.assertEqual(recipe['name'], 'новое название')
+        self.assertEqual([(item['name'], item['amount'])
+                          for item in recipe['ingredients']], [('Соль', 2)])
@@ -2,6 +2,7 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from .views import (IngredientViewSet,
+                    MetricsView,
                     RecipesViewSet,
                     TagViewSet,
                     UserViewSet)
@@ -16,4 +17,5 @@ router.register(r'recipes', RecipesViewSet, basename='recipes')
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,36 +1,52 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db.models import Count, Prefetch, Q, Sum
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from djoser import views
+from djoser import utils, views
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import (AllowAny,
+                                        IsAdminUser,
+                                        IsAuthenticated)
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 
+from foodgram import metrics
 from foodgram.constants import DICT_ERRORS
+from . import bulk, cache, conditional, deletion, loaders, readmodels
 from .filters import IngredientFilter, RecipeFilters
 from .paginators import PageLimitPagination
 from .permissions import (IsAdminOrReadOnly,
                           IsAuthorOrAdminOrReadOnly)
-from .serializers import (BuyRecipe,
-                          BuyRecipeSerializer,
+from .serializers import (BulkIdsSerializer,
+                          BuyRecipe,
+                          ChangesQuerySerializer,
                           IngredientSerializer,
                           FavoriteRecipe,
-                          FavoriteRecipeSerializer,
-                          FollowSerializer,
                           RecipeGetSerializer,
+                          RecipesShortSerializer,
                           RecipeSetSerializer,
                           ShowFollowSerializer,
-                          TagSerializer,)
+                          TagSerializer,
+                          UserSerializer,
+                          get_sparse_fields)
+from recipes import catalog
 from recipes.models import (Ingredient,
                             IngredientRecipe,
                             Recipe,
+                            RecipeChange,
                             Tag)
 from users.models import Follow, User
 
 
+def get_bulk_ids(data):
+    serializer = BulkIdsSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    return list(dict.fromkeys(serializer.validated_data['ids']))
+
+
 class UserViewSet(views.UserViewSet):
     """Вьюсет для обьектов класса User."""
 
@@ -45,18 +61,56 @@ class UserViewSet(views.UserViewSet):
             self.permission_classes = (IsAuthenticated,)
         return super().get_permissions()
 
+    def retrieve(self, request, *args, **kwargs):
+        """Профиль с проверкой If-None-Match до сериализации."""
+        pk = request.user.pk if self.action == 'me' else kwargs['id']
+        return conditional.respond(
+            request,
+            conditional.get_user_validators(request, pk),
+            lambda: super(UserViewSet, self).retrieve(request, *args,
+                                                      **kwargs)
+        )
+
+    def perform_destroy(self, instance):
+        """Удаление отметкой, связанные данные удалит DeletionJob."""
+        if instance == self.request.user:
+            utils.logout_user(self.request)
+        deletion.tombstone_user(instance)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if (self.action in ('list', 'retrieve', 'me')
+                and self.request.method == 'GET'):
+            context['fields'] = get_sparse_fields(
+                self.request.query_params, UserSerializer.Meta.fields)
+        return context
+
     @action(detail=False,
             pagination_class=PageLimitPagination,
             permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
         """Реализация эндпоинта users/subscriptions/ю"""
         user = request.user
+        fields = get_sparse_fields(request.query_params,
+                                   ShowFollowSerializer.Meta.fields)
         folowing = User.objects.filter(following__user=user)
+        if fields is None or 'recipes_count' in fields:
+            folowing = folowing.annotate(
+                recipes_total=Count(
+                    'recipes', filter=Q(recipes__deleted_at__isnull=True),
+                    distinct=True))
+        if fields is None or 'recipes' in fields:
+            folowing = folowing.prefetch_related(Prefetch(
+                'recipes',
+                queryset=Recipe.objects.only('id', 'author_id', 'name',
+                                             'image', 'cooking_time')
+            ))
         pages = self.paginate_queryset(folowing)
         serializer = ShowFollowSerializer(
             pages,
             context={
-                'recipes_limit': request.query_params.get('recipes_limit')
+                'recipes_limit': request.query_params.get('recipes_limit'),
+                'fields': fields
             },
             many=True
         )
@@ -71,29 +125,49 @@ class UserViewSet(views.UserViewSet):
         Реализация эндпоинта users/{id}/subscribe/
         """
         following = get_object_or_404(User, pk=id)
-        serializer = FollowSerializer(
-            data={'user': request.user.id, 'following': following.id},
+        if following.pk == request.user.pk:
+            raise ValidationError({'non_field_errors': [
+                '{0}'.format(DICT_ERRORS.get('subscribe_to_myself'))]})
+        if not bulk.link(Follow, user=request.user.pk,
+                         following=following.pk):
+            raise ValidationError({'non_field_errors': [
+                '{0}'.format(DICT_ERRORS.get('re-subscription'))]})
+        serializer = ShowFollowSerializer(
+            following,
             context={
                 'request': request,
                 'recipes_limit': request.query_params.get('recipes_limit')
             }
         )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
         return Response(serializer.data, status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
     def delete_subscribe(self, request, id):
-        following = get_object_or_404(User, pk=id)
-        through_following = Follow.objects.filter(user=request.user,
-                                                  following=following)
-        if through_following.exists():
-            through_following.delete()
+        if bulk.unlink(Follow, user=request.user, following_id=id):
             return Response(status.HTTP_204_NO_CONTENT)
+        get_object_or_404(User, pk=id)
         return Response({'errors':
                          '{0}'.format(DICT_ERRORS.get('not_subscription'))},
                         status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='subscribe',
+            url_name='subscribe-bulk',
+            permission_classes=(IsAuthenticated,))
+    def subscribe_bulk(self, request):
+        """
+        Реализация эндпоинта users/subscribe/: подписка на авторов
+        из списка ids или отписка от них одним запросом.
+        """
+        ids = get_bulk_ids(request.data)
+        if request.method == 'DELETE':
+            results = bulk.remove(Follow, 'following', request.user, ids)
+        else:
+            results = bulk.add(Follow, 'following', request.user, ids, User,
+                               exclude={request.user.pk})
+        return Response({'results': results})
+
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     """Вьюсет для обьектов класса Tag."""
@@ -102,6 +176,14 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
 
+    def list(self, request, *args, **kwargs):
+        return cache.cached_response(
+            cache.get_catalog_key(request, 'tags'),
+            lambda: super(TagViewSet, self).list(request, *args, **kwargs),
+            name='catalog',
+            timeout=settings.CATALOG_CACHE_TIMEOUT
+        )
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     """Вьюсет для обьектов класса Ingredient."""
@@ -113,6 +195,28 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ('^name', )
     permission_classes = (IsAdminOrReadOnly,)
 
+    def list(self, request, *args, **kwargs):
+        snapshot = catalog.get_snapshot()
+        if snapshot is not None:
+            return Response(snapshot.search(
+                request.query_params.get(IngredientFilter.search_param, '')))
+        return cache.cached_response(
+            cache.get_catalog_key(request, 'ingredients'),
+            lambda: super(IngredientViewSet, self).list(request, *args,
+                                                        **kwargs),
+            name='catalog',
+            timeout=settings.CATALOG_CACHE_TIMEOUT
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        snapshot = catalog.get_snapshot()
+        pk = kwargs['pk']
+        item = snapshot and pk.isdigit() and snapshot.get(int(pk))
+        if item:
+            return Response(item)
+        # Снимок еще не пересобран после добавления ингредиента.
+        return super().retrieve(request, *args, **kwargs)
+
 
 class RecipesViewSet(viewsets.ModelViewSet):
     """Вьюсет для обьектов класса Recipe."""
@@ -127,29 +231,142 @@ class RecipesViewSet(viewsets.ModelViewSet):
             return RecipeGetSerializer
         return RecipeSetSerializer
 
+    def list(self, request, *args, **kwargs):
+        if 'ids' in request.query_params:
+            return self.list_ids(request)
+        if request.user.is_anonymous:
+            return cache.cached_response(cache.get_list_key(request),
+                                         lambda: self.list_page(request))
+        return self.list_page(request)
+
     @staticmethod
-    def add_obj(request, pk, serializers_name):
+    def list_ids(request):
+        """
+        Рецепты по ?ids=1,2,3 в переданном порядке, несуществующие
+        пропускаются. Загрузка идет одним запросом на тип данных.
+        """
+        ids = get_bulk_ids({'ids': [
+            pk for pk in request.query_params['ids'].split(',') if pk]})
+        fields = get_sparse_fields(request.query_params,
+                                   RecipeGetSerializer.Meta.fields)
+        recipes = [recipe for recipe in loaders.get_recipes_loader(
+            request, fields).load_many(ids) if recipe is not None]
+        return Response(readmodels.apply_user_flags(
+            recipes, request, fields or readmodels.RECIPE_FIELDS))
+
+    def list_page(self, request):
+        """
+        Страница списка из закешированных представлений рецептов
+        с наложенными флагами пользователя.
+        """
+        fields = get_sparse_fields(request.query_params,
+                                   RecipeGetSerializer.Meta.fields)
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.paginate_queryset(queryset.values_list('id', 'author_id'))
+        return self.get_paginated_response(
+            readmodels.get_recipes(rows, request, fields))
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional.respond(
+            request,
+            conditional.get_recipe_validators(request, kwargs['pk']),
+            lambda: self.retrieve_body(request, kwargs['pk'])
+        )
+
+    def retrieve_body(self, request, pk):
+        fields = get_sparse_fields(request.query_params,
+                                   RecipeGetSerializer.Meta.fields)
+        if request.user.is_anonymous and fields is None:
+            return cache.cached_response(
+                cache.get_detail_key(request, pk),
+                lambda: self.retrieve_document(request, pk)
+            )
+        return self.retrieve_document(request, pk, fields)
+
+    @staticmethod
+    def retrieve_document(request, pk, fields=None):
+        """
+        Рецепт из документа одним запросом по первичному ключу,
+        усеченный до fields рецепт собирается только из нужных колонок.
+        """
         try:
-            recipe = Recipe.objects.get(pk=pk)
-        except Recipe.DoesNotExist:
+            pk = int(pk)
+        except ValueError:
+            raise Http404
+        if fields is None:
+            documents = readmodels.get_documents([pk])
+        else:
+            documents = readmodels.build_fragments([pk], fields)
+        if pk not in documents:
+            raise Http404
+        return Response(readmodels.apply_user_flags(
+            [documents[pk]], request, fields or readmodels.RECIPE_FIELDS)[0])
+
+    @action(detail=False, permission_classes=(AllowAny,))
+    def changes(self, request):
+        """
+        Реализация эндпоинта recipes/changes/?since=<cursor>: рецепты,
+        измененные и удаленные после курсора, пачками до limit.
+        Следующая пачка запрашивается с полученным cursor, пока has_more.
+        """
+        query = ChangesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        since, limit = (query.validated_data['since'],
+                        query.validated_data['limit'])
+        fields = get_sparse_fields(request.query_params,
+                                   RecipeGetSerializer.Meta.fields)
+        changes = readmodels.get_changes(since, limit)
+        updated = [recipe_id for _, recipe_id, kind in changes
+                   if kind == RecipeChange.UPDATED]
+        recipes = {
+            recipe_id: recipe for recipe_id, recipe in zip(
+                updated,
+                loaders.get_recipes_loader(request, fields).load_many(updated))
+            if recipe is not None
+        }
+        readmodels.apply_user_flags(list(recipes.values()), request,
+                                    fields or readmodels.RECIPE_FIELDS)
+        results = []
+        for _, recipe_id, kind in changes:
+            recipe = recipes.get(recipe_id)
+            results.append({
+                'id': recipe_id,
+                'action': kind if recipe else RecipeChange.DELETED,
+                'recipe': recipe
+            })
+        return Response({
+            'cursor': changes[-1][0] if changes else since,
+            'has_more': len(changes) == limit,
+            'results': results
+        })
+
+    def perform_destroy(self, instance):
+        deletion.tombstone_recipe(instance)
+
+    @staticmethod
+    def add_obj(request, pk, model_name):
+        """
+        Рецепт для ответа и вставка связи без проверки на дубликат:
+        два запроса, повторное добавление определяется по числу строк.
+        """
+        recipe = Recipe.objects.filter(pk=pk).only(
+            'id', 'name', 'image', 'cooking_time').first()
+        if recipe is None:
             raise ValidationError(
                 '{0}'.format(DICT_ERRORS.get('recipe_not_exist'))
             )
-        serializer = serializers_name(data={'recipe': recipe.id,
-                                            'user': request.user.id},
-                                      context={'request': request})
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        if not bulk.link(model_name, user=request.user.pk, recipe=recipe.pk):
+            raise ValidationError({'non_field_errors': [
+                '{0}'.format(DICT_ERRORS.get('re-recipe'))]})
+        serializer = RecipesShortSerializer(recipe,
+                                            context={'request': request})
         return Response(serializer.data, status.HTTP_201_CREATED)
 
     @staticmethod
     def delate_obj(request, pk, model_name):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        through_obj = model_name.objects.filter(user=request.user,
-                                                recipe=recipe)
-        if through_obj.exists():
-            through_obj.delete()
+        if bulk.unlink(model_name, user=request.user, recipe_id=pk):
             return Response(status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, pk=pk)
         return Response({'errors':
                          '{0}'.format(DICT_ERRORS.get('not-recipe'))},
                         status=status.HTTP_400_BAD_REQUEST)
@@ -161,7 +378,7 @@ class RecipesViewSet(viewsets.ModelViewSet):
         """
         Реализация эндпоинта recipe/{id}/favorite/
         """
-        return self.add_obj(request, pk, FavoriteRecipeSerializer)
+        return self.add_obj(request, pk, FavoriteRecipe)
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk):
@@ -174,12 +391,48 @@ class RecipesViewSet(viewsets.ModelViewSet):
         """
         Реализация эндпоинта recipe/{id}/shopping_cart/
         """
-        return self.add_obj(request, pk, BuyRecipeSerializer)
+        return self.add_obj(request, pk, BuyRecipe)
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
         return self.delate_obj(request, pk, BuyRecipe)
 
+    @staticmethod
+    def bulk_obj(request, model_name):
+        ids = get_bulk_ids(request.data)
+        if request.method == 'DELETE':
+            return Response({'results': bulk.remove(model_name, 'recipe',
+                                                    request.user, ids)})
+        if request.method == 'PUT':
+            results, removed = bulk.replace(model_name, 'recipe',
+                                            request.user, ids, Recipe)
+            return Response({'results': results, 'removed': removed})
+        return Response({'results': bulk.add(model_name, 'recipe',
+                                             request.user, ids, Recipe)})
+
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='favorite',
+            url_name='favorite-bulk',
+            permission_classes=(IsAuthenticated,))
+    def favorite_bulk(self, request):
+        """
+        Реализация эндпоинта recipe/favorite/ для списка ids
+        """
+        return self.bulk_obj(request, FavoriteRecipe)
+
+    @action(methods=['post', 'put', 'delete'],
+            detail=False,
+            url_path='shopping_cart',
+            url_name='shopping-cart-bulk',
+            permission_classes=(IsAuthenticated,))
+    def shopping_cart_bulk(self, request):
+        """
+        Реализация эндпоинта recipe/shopping_cart/ для списка ids,
+        PUT заменяет список покупок переданным набором.
+        """
+        return self.bulk_obj(request, BuyRecipe)
+
     @action(detail=False,
             permission_classes=(IsAuthenticated,))
     def download_shopping_cart(self, request):
@@ -187,22 +440,36 @@ class RecipesViewSet(viewsets.ModelViewSet):
         Реализация скачивание списка ингридиентов
         """
         qw_st = IngredientRecipe.objects.filter(
-            recipe__buy_recipe__user=request.user
+            recipe__buy_recipe__user=request.user,
+            recipe__deleted_at__isnull=True
         ).values(
             'ingredient__name',
             'ingredient__measurement_unit',).annotate(
                 amount=Sum('amount')).order_by('ingredient__name')
 
-        ingredient_list = 'Cписок покупок:'
-        for value in qw_st:
-            name = value['ingredient__name']
-            measurement_unit = value['ingredient__measurement_unit']
-            amount = value['amount']
-            ingredient_list += f'\n{name} - {amount} {measurement_unit}'
+        def ingredient_list():
+            # Строки отдаются по мере чтения из базы.
+            yield 'Cписок покупок:'
+            for value in qw_st.iterator():
+                name = value['ingredient__name']
+                measurement_unit = value['ingredient__measurement_unit']
+                amount = value['amount']
+                yield f'\n{name} - {amount} {measurement_unit}'
+
         file = 'ingredient_list'
-        response = HttpResponse(
-            ingredient_list,
+        response = StreamingHttpResponse(
+            ingredient_list(),
             content_type='text/plain'
         )
         response['Content-Disposition'] = f'attachment; filename={file}.pdf'
         return response
+
+
+class MetricsView(APIView):
+    """Метрики производительности в формате Prometheus для админа."""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(metrics.render(),
+                            content_type='text/plain; version=0.0.4')
@@ -1,7 +1,12 @@
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+from foodgram.events import EventsRouter  # noqa: E402
+from foodgram.handlers import PooledASGIHandler  # noqa: E402
+
+application = EventsRouter(PooledASGIHandler())
@@ -25,6 +25,8 @@ DICT_ERRORS = {
     'Поле должно содержать HEX-код цвета в формате #RRGGBB',
     'forbidden_username': 'me',
     're_username': 'Вы уже подписаны',
+    're-subscription': 'Вы уже подписаны на этого автора!',
     'tags_not_unique': 'Теги должны быть уникальны',
-    'tags_not_exist': 'Указанного тега не существует'
+    'tags_not_exist': 'Указанного тега не существует',
+    'unknown_fields': 'Неизвестные поля'
 }
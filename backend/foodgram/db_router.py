@@ -0,0 +1,140 @@
+import hashlib
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import OperationalError
+
+_use_primary = ContextVar('use_primary', default=False)
+_failed_replica = ContextVar('failed_replica', default=None)
+_down_until = {}
+
+
+def use_primary():
+    return (_use_primary.get()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block)
+
+
+@contextmanager
+def primary():
+    """Все чтения внутри блока идут в основную базу."""
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def mark_down(alias):
+    """Реплика исключается из выбора на DATABASE_REPLICA_RETRY секунд."""
+    _down_until[alias] = time.monotonic() + settings.DATABASE_REPLICA_RETRY
+
+
+def _is_alive(alias):
+    if _down_until.get(alias, 0) > time.monotonic():
+        return False
+    connection = connections[alias]
+    if connection.connection is None:
+        try:
+            connection.ensure_connection()
+        except OperationalError:
+            mark_down(alias)
+            return False
+    return True
+
+
+def _guard(execute, sql, params, many, context):
+    try:
+        return execute(sql, params, many, context)
+    except OperationalError:
+        alias = context['connection'].alias
+        mark_down(alias)
+        _failed_replica.set(alias)
+        raise
+
+
+@contextmanager
+def watch_replicas():
+    """
+    Ошибка запроса к реплике внутри блока (реплика упала уже после
+    подключения) помечает ее недоступной, а replica_failed() сообщает,
+    что чтение можно повторить в основной базе.
+    """
+    token = _failed_replica.set(None)
+    try:
+        with ExitStack() as stack:
+            for alias in settings.DATABASE_REPLICAS:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(_guard))
+            yield
+    finally:
+        _failed_replica.reset(token)
+
+
+def replica_failed():
+    return _failed_replica.get() is not None
+
+
+def choose_replica():
+    """Взвешенный выбор живой реплики, при отказе всех - основная база."""
+    replicas = dict(settings.DATABASE_REPLICAS)
+    while replicas:
+        alias = random.choices(list(replicas),
+                               weights=list(replicas.values()))[0]
+        if _is_alive(alias):
+            return alias
+        del replicas[alias]
+    return DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """
+    Чтения распределяются по репликам DATABASE_REPLICAS,
+    записи, транзакции и закрепленные запросы идут в основную базу.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or use_primary():
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return choose_replica()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def get_pin_key(request):
+    """Ключ закрепления клиента: токен или сессия."""
+    credentials = (request.META.get('HTTP_AUTHORIZATION')
+                   or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credentials:
+        return None
+    digest = hashlib.sha1(credentials.encode()).hexdigest()
+    return f'db-pin:{digest}'
+
+
+def is_pinned(request):
+    key = get_pin_key(request)
+    return key is not None and cache.get(key) is not None
+
+
+def pin(request):
+    """
+    Закрепляет клиента за основной базой на DATABASE_PIN_SECONDS,
+    чтобы он видел собственные изменения, пока реплики догоняют.
+    """
+    key = get_pin_key(request)
+    if key is not None:
+        cache.set(key, 1, settings.DATABASE_PIN_SECONDS)
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.authentication import CachedTokenAuthentication
+from users.models import Follow
+
+
+class Subscription:
+    """
+    Очередь событий одного соединения. Очередь ограничена
+    EVENTS_QUEUE_SIZE: при переполнении отбрасываются самые старые
+    события, пропущенное клиент забирает из recipes/changes/.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(settings.EVENTS_QUEUE_SIZE)
+
+    def put(self, event):
+        """Вызывается из любого потока."""
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def disconnect(self):
+        self._put(None)
+
+    def _put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class LocalBroker:
+    """
+    Pub/sub внутри процесса: события получают только соединения
+    этого же процесса. Для нескольких процессов нужен брокер с тем же
+    интерфейсом поверх внешней шины (EVENTS_BROKER).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def listeners(self):
+        """Пользователи с открытыми соединениями."""
+        with self._lock:
+            return set(self._subscriptions)
+
+    def publish(self, user_ids, event):
+        with self._lock:
+            subscriptions = [subscription for user_id in user_ids
+                             for subscription in self._subscriptions.get(
+                                 user_id, ())]
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+broker = import_string(settings.EVENTS_BROKER)()
+
+
+def publish_recipe(recipe_id, author_id, action):
+    """Событие о рецепте для подписчиков автора, подключенных сейчас."""
+    listeners = broker.listeners()
+    if not listeners:
+        return
+    followers = Follow.objects.filter(
+        following_id=author_id, user_id__in=listeners
+    ).values_list('user_id', flat=True)
+    broker.publish(set(followers), {'event': 'recipe',
+                                    'data': {'id': recipe_id,
+                                             'author': author_id,
+                                             'action': action}})
+
+
+def format_event(event):
+    return 'event: {0}\ndata: {1}\n\n'.format(
+        event['event'], json.dumps(event['data'])).encode()
+
+
+def get_token(scope):
+    """Токен только из заголовка Authorization: параметр в адресе
+    попал бы в журналы nginx и прокси."""
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            parts = value.decode('latin-1').split()
+            if len(parts) == 2 and parts[0].lower() == 'token':
+                return parts[1]
+    return None
+
+
+def authenticate(key):
+    """Вызывается в потоке из пула в обход обработчика запросов Django,
+    поэтому соединение с базой закрывается здесь же."""
+    try:
+        user, _ = CachedTokenAuthentication().authenticate_credentials(key)
+    except AuthenticationFailed:
+        return None
+    finally:
+        close_old_connections()
+    return user
+
+
+async def send_status(send, status):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def events_app(scope, receive, send):
+    """
+    Поток событий text/event-stream для пользователя по токену.
+    Соединение без событий держит только корутину: поток из пула
+    занимается лишь на время проверки токена.
+    """
+    if scope['method'] != 'GET':
+        return await send_status(send, 405)
+    key = get_token(scope)
+    user = key and await sync_to_async(authenticate,
+                                       thread_sensitive=False)(key)
+    if not user:
+        return await send_status(send, 401)
+
+    subscription = broker.subscribe(user.pk)
+
+    async def watch():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        # Будит цикл ниже, не дожидаясь keepalive.
+        subscription.disconnect()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        await send({'type': 'http.response.body', 'body': b': connected\n\n',
+                    'more_body': True})
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscription.queue.get(), settings.EVENTS_KEEPALIVE)
+                if event is None:
+                    break
+                body = format_event(event)
+            except asyncio.TimeoutError:
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body,
+                        'more_body': True})
+    finally:
+        watcher.cancel()
+        broker.unsubscribe(subscription)
+
+
+class EventsRouter:
+    """ASGI-приложение: EVENTS_PATH обслуживается events_app,
+    остальное - Django."""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] == 'http'
+                and scope['path'] == settings.EVENTS_PATH):
+            return await events_app(scope, receive, send)
+        return await self.application(scope, receive, send)
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+
+executor = ThreadPoolExecutor(settings.ASGI_THREADS,
+                              thread_name_prefix='asgi')
+
+_DONE = object()
+
+
+def run_in_pool(func, *args):
+    """Выполняет синхронную работу (ORM, сериализацию) в пуле ASGI_THREADS."""
+    return asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+class PooledASGIHandler(ASGIHandler):
+    """
+    ASGI-обработчик Django 3.2, который выполняет синхронные
+    представления и middleware в ограниченном пуле потоков, а не
+    в единственном общем потоке sync_to_async. Ожидание медленных
+    клиентов и отдача тела идут в цикле событий без занятого потока.
+    Потоковые ответы читаются одним потоком пула с обратным давлением.
+    """
+
+    def load_middleware(self, is_async=False):
+        super().load_middleware(is_async=False)
+
+    async def get_response_async(self, request):
+        return await run_in_pool(self.get_response_in_thread, request)
+
+    def get_response_in_thread(self, request):
+        close_old_connections()
+        try:
+            return self.get_response(request)
+        finally:
+            close_old_connections()
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        queue = asyncio.Queue(settings.ASGI_STREAM_BUFFER)
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+
+        def produce():
+            close_old_connections()
+            try:
+                for part in response:
+                    for chunk, _ in self.chunk_bytes(part):
+                        if cancelled.is_set():
+                            return
+                        asyncio.run_coroutine_threadsafe(
+                            queue.put(chunk), loop).result()
+            finally:
+                close_old_connections()
+                asyncio.run_coroutine_threadsafe(
+                    queue.put(_DONE), loop).result()
+
+        await send({'type': 'http.response.start',
+                    'status': response.status_code,
+                    'headers': self.get_response_headers(response)})
+        producer = run_in_pool(produce)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is _DONE:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': True})
+        except BaseException:
+            # Клиент отключился: освобождаем поток пула.
+            cancelled.set()
+            while not producer.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.sleep(0)
+            raise
+        await producer
+        await send({'type': 'http.response.body'})
+        await run_in_pool(response.close)
+
+    @staticmethod
+    def get_response_headers(response):
+        headers = [
+            (header.encode('ascii') if isinstance(header, str) else header,
+             value.encode('latin1') if isinstance(value, str) else value)
+            for header, value in response.items()
+        ]
+        headers.extend(
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values())
+        return headers
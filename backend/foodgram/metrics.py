@@ -0,0 +1,208 @@
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HISTOGRAMS = {
+    'foodgram_request_duration_seconds': LATENCY_BUCKETS,
+    'foodgram_request_db_seconds': LATENCY_BUCKETS,
+    'foodgram_request_queries': QUERY_BUCKETS,
+}
+
+
+class MetricsStore:
+    """
+    Агрегатор метрик процесса.
+    Каждый воркер копит гистограммы и счетчики в памяти и периодически
+    сбрасывает их в собственный файл METRICS_DIR/metrics-<pid>.json,
+    эндпоинт метрик суммирует файлы всех воркеров.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Запись файла отдельно от накопления: observe не ждет диска,
+        # а более старое состояние не перезапишет более новое.
+        self._flush_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._histograms = {}
+        self._counters = defaultdict(float)
+        self._flushed_at = 0
+
+    def _check_fork(self):
+        # После fork в gunicorn воркер не должен наследовать данные мастера.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def observe(self, name, value, **labels):
+        buckets = HISTOGRAMS[name]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            data = self._histograms.get(key)
+            if data is None:
+                data = self._histograms[key] = [0] * (len(buckets) + 1) + [0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(buckets)
+            data[index] += 1
+            data[-1] += value
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._check_fork()
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def flush(self, force=False):
+        """Атомарно записывает состояние процесса в файл воркера."""
+        now = time.monotonic()
+        with self._flush_lock:
+            with self._lock:
+                self._check_fork()
+                interval = settings.METRICS_FLUSH_INTERVAL
+                if not force and now - self._flushed_at < interval:
+                    return
+                self._flushed_at = now
+                pid = self._pid
+                payload = {
+                    'histograms': [[name, labels, list(data)]
+                                   for (name, labels), data
+                                   in self._histograms.items()],
+                    'counters': [[name, labels, value]
+                                 for (name, labels), value
+                                 in self._counters.items()],
+                }
+            _write(_get_path(pid), payload, pid)
+
+
+store = MetricsStore()
+
+
+def _get_path(pid):
+    return os.path.join(settings.METRICS_DIR, f'metrics-{pid}.json')
+
+
+def _write(path, payload, pid):
+    """Запись в уникальный временный файл и атомарная подмена,
+    как в foodgram.storage."""
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.METRICS_DIR,
+                                    prefix=f'.metrics-{pid}-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _merge(histograms, counters, path):
+    try:
+        with open(path) as f:
+            payload = json.load(f)
+    except (OSError, ValueError):
+        return
+    for name, labels, data in payload['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        total = histograms.setdefault(key, [0] * len(data))
+        for index, value in enumerate(data):
+            total[index] += value
+    for name, labels, value in payload['counters']:
+        counters[(name, tuple(map(tuple, labels)))] += value
+
+
+def mark_process_dead(pid):
+    """
+    Вызывается мастером gunicorn после выхода воркера: данные воркера
+    добавляются в общий файл metrics-archive.json, а его файл удаляется.
+    Так число файлов не растет с перезапусками воркеров, а счетчики
+    не уменьшаются.
+    """
+    path = _get_path(pid)
+    if not os.path.exists(path):
+        return
+    archive = _get_path('archive')
+    histograms = {}
+    counters = defaultdict(float)
+    _merge(histograms, counters, archive)
+    _merge(histograms, counters, path)
+    _write(archive, {
+        'histograms': [[name, labels, data]
+                       for (name, labels), data in histograms.items()],
+        'counters': [[name, labels, value]
+                     for (name, labels), value in counters.items()],
+    }, 'archive')
+    leftovers = glob.glob(os.path.join(settings.METRICS_DIR,
+                                       f'.metrics-{pid}-*.tmp'))
+    for name in (path, *leftovers):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def collect():
+    """Собирает метрики всех воркеров."""
+    store.flush(force=True)
+    histograms = {}
+    counters = defaultdict(float)
+    try:
+        filenames = os.listdir(settings.METRICS_DIR)
+    except FileNotFoundError:
+        filenames = []
+    for filename in filenames:
+        if (filename.startswith('metrics-')
+                and filename.endswith('.json')):
+            _merge(histograms, counters,
+                   os.path.join(settings.METRICS_DIR, filename))
+    return histograms, counters
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    pairs = ','.join(
+        '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\')
+                           .replace('"', '\\"'))
+        for key, value in items
+    )
+    return '{' + pairs + '}'
+
+
+def render():
+    """Отдает метрики в текстовом формате Prometheus."""
+    histograms, counters = collect()
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        buckets = HISTOGRAMS[name]
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, labels), data in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), data[:-1]):
+                cumulative += count
+                lines.append('{0}_bucket{1} {2}'.format(
+                    name, _format_labels(labels, le=bound), cumulative))
+            lines.append(f'{name}_sum{_format_labels(labels)} {data[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
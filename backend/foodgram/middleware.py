@@ -0,0 +1,177 @@
+import cProfile
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.utils import OperationalError
+from rest_framework.permissions import SAFE_METHODS
+
+from foodgram import db_router, metrics, profiling
+from foodgram.querylog import QueryInspector
+
+
+def get_view_name(request):
+    """
+    Имя обработчика запроса: 'RecipesViewSet.list',
+    'UserViewSet.subscriptions' и т.п.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    cls = getattr(match.func, 'cls', None)
+    if cls is None:
+        return match.view_name or match.func.__qualname__
+    method = request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return f'{cls.__name__}.{actions.get(method, method)}'
+
+
+class QueryTimer:
+    """Обертка execute_wrapper, считающая запросы и время в БД."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class PerformanceMiddleware:
+    """
+    Замеряет общее время, время в БД и количество запросов
+    для каждого обработчика, отдает заголовок Server-Timing
+    и копит гистограммы для эндпоинта метрик.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        view = get_view_name(request)
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = (
+                f'total;dur={total * 1000:.1f}, '
+                f'db;dur={timer.duration * 1000:.1f};'
+                f'desc="{timer.count} queries"'
+            )
+        metrics.store.observe('foodgram_request_duration_seconds', total,
+                              view=view)
+        metrics.store.observe('foodgram_request_db_seconds', timer.duration,
+                              view=view)
+        metrics.store.observe('foodgram_request_queries', timer.count,
+                              view=view)
+        metrics.store.inc('foodgram_requests_total', view=view,
+                          status=response.status_code)
+        metrics.store.flush()
+        return response
+
+
+class QueryInspectorMiddleware:
+    """
+    Поиск N+1 и медленных запросов: в режиме warn пишет в лог,
+    в режиме raise (по умолчанию в тестах) выбрасывает NPlusOneError.
+    """
+
+    def __init__(self, get_response):
+        if settings.QUERY_INSPECTOR_MODE not in ('warn', 'raise'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        inspector = QueryInspector()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(inspector))
+            response = self.get_response(request)
+        inspector.report(get_view_name(request))
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запроса cProfile: запросы админа с заголовком X-Profile
+    и случайная выборка PROFILE_SAMPLE_RATE всех запросов.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = profiling.is_requested(request)
+        sampled = profiling.is_sampled()
+        if not (requested or sampled):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # В потоке уже работает другой профилировщик.
+            return self.get_response(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - start
+
+        filename = profiling.dump(profiler, get_view_name(request), duration)
+        if requested:
+            response['X-Profile-Id'] = filename
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Небезопасные запросы и клиенты, недавно что-то изменившие,
+    читают из основной базы, остальные - из реплик.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in SAFE_METHODS:
+            if not db_router.is_pinned(request):
+                with db_router.watch_replicas():
+                    return self.get_response(request)
+            with db_router.primary():
+                return self.get_response(request)
+
+        with db_router.primary():
+            response = self.get_response(request)
+        if response.status_code < 400:
+            db_router.pin(request)
+        return response
+
+    def process_exception(self, request, exception):
+        """
+        Реплика отказала во время чтения: запрос повторяется
+        в основной базе, клиент не получает 500.
+        """
+        if (request.method in SAFE_METHODS
+                and isinstance(exception, OperationalError)
+                and db_router.replica_failed()):
+            with db_router.primary():
+                return self.get_response(request)
+        return None
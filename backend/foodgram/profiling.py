@@ -0,0 +1,77 @@
+import os
+import random
+import re
+import time
+
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+RE_UNSAFE = re.compile(r'[^\w.]+')
+
+
+def is_requested(request):
+    """
+    Профилирование запрошено заголовком X-Profile от администратора.
+    Пользователь определяется до запуска профилировщика теми же
+    классами аутентификации, что и в DRF; от остальных клиентов
+    заголовок игнорируется.
+    """
+    if not request.META.get(PROFILE_HEADER):
+        return False
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        if result is not None:
+            return result[0].is_staff
+    return False
+
+
+def is_sampled():
+    return random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+def dump(profiler, view, duration):
+    """
+    Сохраняет профиль в PROFILE_DIR с именем
+    <время>-<обработчик>-<длительность>ms.prof и удаляет самые старые
+    файлы сверх PROFILE_MAX_FILES.
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    filename = '{0}-{1}-{2}ms.prof'.format(
+        time.strftime('%Y%m%d%H%M%S'),
+        RE_UNSAFE.sub('_', view),
+        int(duration * 1000),
+    )
+    path = os.path.join(settings.PROFILE_DIR, filename)
+    profiler.dump_stats(path)
+    rotate()
+    return filename
+
+
+def list_dumps(view=None):
+    """Файлы профилей от старых к новым, опционально для одного обработчика."""
+    try:
+        filenames = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    dumps = sorted(name for name in filenames if name.endswith('.prof'))
+    if view is not None:
+        marker = f'-{RE_UNSAFE.sub("_", view)}-'
+        dumps = [name for name in dumps if marker in name]
+    return [os.path.join(settings.PROFILE_DIR, name) for name in dumps]
+
+
+def rotate():
+    dumps = list_dumps()
+    for path in dumps[:max(len(dumps) - settings.PROFILE_MAX_FILES, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
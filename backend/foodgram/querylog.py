@@ -0,0 +1,100 @@
+import logging
+import re
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from rest_framework.fields import Field
+from rest_framework.views import APIView
+
+logger = logging.getLogger('foodgram.queries')
+
+RE_STRING = re.compile(r"'(?:[^']|'')*'")
+RE_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+RE_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+RE_SPACES = re.compile(r'\s+')
+
+APP_PACKAGES = ('api', 'recipes', 'users')
+
+
+class NPlusOneError(Exception):
+    """Повторяющиеся однотипные запросы в рамках одного HTTP-запроса."""
+
+
+def fingerprint(sql):
+    """Приводит SQL к форме без литералов и длины списков IN (...)."""
+    sql = RE_STRING.sub('?', sql)
+    sql = RE_NUMBER.sub('?', sql)
+    sql = RE_IN_LIST.sub('IN (...)', sql)
+    return RE_SPACES.sub(' ', sql).strip()
+
+
+def get_origin():
+    """
+    Место вызова запроса: ближайший кадр кода приложений проекта,
+    иначе поле сериализатора или вьюсет, внутри которых он выполнен.
+    """
+    prefixes = tuple(str(settings.BASE_DIR / package)
+                     for package in APP_PACKAGES)
+    field = view = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.startswith(prefixes):
+            return f'{code.co_filename}:{frame.f_lineno} in {code.co_name}'
+        # type(), а не isinstance: isinstance вычисляет ленивые объекты
+        # вроде request.user и выполняет запрос внутри обертки.
+        owner = type(frame.f_locals.get('self'))
+        if field is None and issubclass(owner, Field):
+            owner = frame.f_locals['self']
+            if owner.parent:
+                field = f'{type(owner.parent).__name__}.{owner.field_name}'
+        elif view is None and issubclass(owner, APIView):
+            view = f'{owner.__name__}.{code.co_name}'
+        frame = frame.f_back
+    return field or view or '<unknown>'
+
+
+class QueryInspector:
+    """
+    Обертка execute_wrapper: считает запросы по отпечаткам
+    и пишет в лог медленные запросы с местом вызова.
+    """
+
+    def __init__(self):
+        self.fingerprints = Counter()
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            key = fingerprint(sql)
+            self.fingerprints[key] += 1
+            if key not in self.origins:
+                self.origins[key] = get_origin()
+            if duration >= settings.QUERY_INSPECTOR_SLOW_MS:
+                logger.warning('Медленный запрос %.1f мс (%s): %s',
+                               duration, get_origin(), sql)
+
+    def repeated(self):
+        threshold = settings.QUERY_INSPECTOR_REPEAT_THRESHOLD
+        return [(key, count, self.origins[key])
+                for key, count in self.fingerprints.most_common()
+                if count >= threshold]
+
+    def report(self, view):
+        """Сообщает о N+1 согласно QUERY_INSPECTOR_MODE."""
+        repeated = self.repeated()
+        if not repeated:
+            return
+        message = '\n'.join(
+            f'{view}: {count} однотипных запросов из {origin}: {key}'
+            for key, count, origin in repeated
+        )
+        if settings.QUERY_INSPECTOR_MODE == 'raise':
+            raise NPlusOneError(message)
+        logger.warning(message)
@@ -1,4 +1,6 @@
 import os
+import sys
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -37,6 +39,10 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'foodgram.middleware.PerformanceMiddleware',
+    'foodgram.middleware.ReplicaRoutingMiddleware',
+    'foodgram.middleware.ProfilingMiddleware',
+    'foodgram.middleware.QueryInspectorMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -63,6 +69,9 @@ SQLITE = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Тесты с потоками: у базы в памяти блокировки на уровне таблиц
+        # без ожидания, файл ждет освобождения до timeout.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -79,6 +88,72 @@ PSQL = {
 
 DATABASES = SQLITE if DEBUG else PSQL
 
+# Реплики для чтения: DB_REPLICAS=host[:port][=вес];...
+# При DEBUG вместо хоста указывается путь к файлу SQLite.
+DATABASE_REPLICAS = {}
+for index, replica in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', '').split(';'))):
+    location, _, weight = replica.partition('=')
+    alias = f'replica_{index}'
+    DATABASES[alias] = dict(DATABASES['default'],
+                            TEST={'MIRROR': 'default'})
+    if DEBUG:
+        DATABASES[alias]['NAME'] = location
+    else:
+        host, _, port = location.partition(':')
+        DATABASES[alias]['HOST'] = host
+        DATABASES[alias]['PORT'] = port or DATABASES[alias]['PORT']
+    DATABASE_REPLICAS[alias] = int(weight or 1)
+
+DATABASE_ROUTERS = ['foodgram.db_router.ReplicaRouter']
+DATABASE_PIN_SECONDS = int(os.getenv('DB_PIN_SECONDS', 5))
+DATABASE_REPLICA_RETRY = int(os.getenv('DB_REPLICA_RETRY', 30))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+# Кеш в памяти процесса не виден другим воркерам.
+CACHE_IS_SHARED = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+# Кеш в памяти процесса не узнает о смене версии в других процессах
+# (например, после manage.py), поэтому живет недолго.
+RESPONSE_CACHE_TIMEOUT = int(os.getenv(
+    'RESPONSE_CACHE_TIMEOUT', 24 * 60 * 60 if CACHE_IS_SHARED else 60))
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 60 * 60))
+SINGLE_FLIGHT_LEASE = float(os.getenv('SINGLE_FLIGHT_LEASE', 10))
+SINGLE_FLIGHT_STALE = int(os.getenv('SINGLE_FLIGHT_STALE', 60))
+SINGLE_FLIGHT_POLL = float(os.getenv('SINGLE_FLIGHT_POLL', 0.05))
+SINGLE_FLIGHT_BETA = float(os.getenv('SINGLE_FLIGHT_BETA', 1))
+
+DOCUMENT_BATCH_SIZE = int(os.getenv('DOCUMENT_BATCH_SIZE', 500))
+
+CATALOG_SNAPSHOT_PATH = os.getenv(
+    'CATALOG_SNAPSHOT_PATH',
+    os.path.join(tempfile.gettempdir(), 'foodgram_catalog', 'ingredients'))
+CATALOG_SNAPSHOT_CHECK = float(os.getenv('CATALOG_SNAPSHOT_CHECK', 1))
+
+CHANGES_BATCH_SIZE = int(os.getenv('CHANGES_BATCH_SIZE', 100))
+CHANGES_SETTLE_SECONDS = float(os.getenv('CHANGES_SETTLE_SECONDS', 1))
+
+DELETION_BATCH_SIZE = int(os.getenv('DELETION_BATCH_SIZE', 500))
+DELETION_JOB_TIMEOUT = int(os.getenv('DELETION_JOB_TIMEOUT', 10 * 60))
+
+WARMUP_ON_READY = os.getenv('WARMUP_ON_READY', 'false').lower() == 'true'
+
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 16))
+ASGI_STREAM_BUFFER = int(os.getenv('ASGI_STREAM_BUFFER', 16))
+
+EVENTS_PATH = os.getenv('EVENTS_PATH', '/api/events/')
+EVENTS_BROKER = os.getenv('EVENTS_BROKER', 'foodgram.events.LocalBroker')
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', 100))
+EVENTS_KEEPALIVE = float(os.getenv('EVENTS_KEEPALIVE', 15))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -109,6 +184,11 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+DEFAULT_FILE_STORAGE = os.getenv(
+    'DEFAULT_FILE_STORAGE', 'foodgram.storage.ContentHashStorage')
+# Файлы моложе этого возраста gc_media не трогает: рецепт с только что
+# загруженной картинкой может быть еще не сохранен.
+MEDIA_GC_MIN_AGE = int(os.getenv('MEDIA_GC_MIN_AGE', 60 * 60))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -119,12 +199,20 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS':
         ['django_filters.rest_framework.DjangoFilterBackend']
 }
 
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 10000))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', 300))
+
+BULK_MAX_IDS = int(os.getenv('BULK_MAX_IDS', 100))
+
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(
+    os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000))
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'SERIALIZERS': {
@@ -137,3 +225,22 @@ DJOSER = {
     },
     'HIDE_USERS': False,
 }
+
+SERVER_TIMING_HEADER = os.getenv(
+    'SERVER_TIMING_HEADER', 'true').lower() == 'true'
+
+METRICS_DIR = os.getenv(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'foodgram_metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))
+
+QUERY_INSPECTOR_MODE = os.getenv(
+    'QUERY_INSPECTOR_MODE', 'raise' if 'test' in sys.argv else 'off')
+QUERY_INSPECTOR_REPEAT_THRESHOLD = int(
+    os.getenv('QUERY_INSPECTOR_REPEAT_THRESHOLD', 5))
+QUERY_INSPECTOR_SLOW_MS = float(os.getenv('QUERY_INSPECTOR_SLOW_MS', 100))
+
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'false').lower() == 'true'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.getenv(
+    'PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'foodgram_profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentHashStorage(FileSystemStorage):
+    """
+    Файл хранится под именем sha256 содержимого в каталоге upload_to:
+    recipes/images/ab/ab12...ef.png. Повторная загрузка той же картинки
+    не создает новый файл. Один файл может принадлежать нескольким
+    рецептам, поэтому файлы не удаляются вместе с рецептом, а
+    собираются командой gc_media.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_hashed_name(name, content)
+        if self.exists(name):
+            # Свежая дата защищает файл от gc_media, пока рецепт
+            # с ним еще не сохранен.
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # gc_media удалил файл после проверки exists.
+                pass
+        return self._save(name, content)
+
+    @staticmethod
+    def get_hashed_name(name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def _save(self, name, content):
+        """Запись во временный файл и атомарная подмена: параллельная
+        загрузка того же содержимого пишет тот же файл."""
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode,
+                            exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return name
@@ -0,0 +1,60 @@
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.urls import get_resolver
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import filters, serializers
+from api.views import IngredientViewSet, TagViewSet
+from recipes import catalog
+
+logger = logging.getLogger('foodgram.warmup')
+
+
+def warm_up_code():
+    """
+    Прогрев без обращения к базе: индексы URL-резолвера, поля
+    сериализаторов и фильтры. Выполняется в мастере gunicorn до fork,
+    поэтому результат делится воркерами через copy-on-write.
+    """
+    resolver = get_resolver()
+    resolver.resolve('/api/recipes/')
+    resolver.reverse('recipes-list')
+    request = Request(APIRequestFactory().get(
+        '/', HTTP_HOST=settings.ALLOWED_HOSTS[0]))
+    for serializer in (serializers.RecipeGetSerializer,
+                       serializers.RecipeSetSerializer,
+                       serializers.UserSerializer,
+                       serializers.ShowFollowSerializer,
+                       serializers.TagSerializer,
+                       serializers.IngredientSerializer):
+        serializer(context={'request': request}).fields
+    filters.RecipeFilters(request=request).form
+
+
+def prime_catalogs():
+    """Заполняет кеш списков тегов и ингредиентов."""
+    factory = APIRequestFactory()
+    for viewset, path in ((TagViewSet, '/api/tags/'),
+                          (IngredientViewSet, '/api/ingredients/')):
+        viewset.as_view({'get': 'list'})(
+            factory.get(path, HTTP_HOST=settings.ALLOWED_HOSTS[0]))
+
+
+def warm_up():
+    """
+    Полный прогрев процесса. Снимок справочника ингредиентов собирается
+    заново: пока сервис был остановлен, таблица могла измениться.
+    Ошибка базы не мешает запуску, соединения закрываются, чтобы
+    воркеры после fork не делили сокеты мастера.
+    """
+    warm_up_code()
+    try:
+        catalog.build_snapshot()
+        prime_catalogs()
+    except DatabaseError:
+        logger.warning('Справочники не прогреты', exc_info=True)
+    finally:
+        connections.close_all()
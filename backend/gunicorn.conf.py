@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:9050')
+wsgi_app = os.getenv('GUNICORN_APP', 'foodgram.wsgi')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(os.getenv('GUNICORN_WORKERS',
+                        multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+# Перезапуск воркеров вразнобой, чтобы они не прогревались одновременно.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+# Приложение загружается в мастере и делится воркерами через
+# copy-on-write, прогрев в AppConfig.ready выполняется один раз.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+os.environ.setdefault('WARMUP_ON_READY', 'true')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+
+
+def on_starting(server):
+    """
+    Версии кешированных ответов, токенов и блокировки пересчета живут
+    в кеше Django: с кешем в памяти процесса воркеры не видят изменений
+    друг друга и отдают устаревшие ответы.
+    """
+    from django.conf import settings
+    if workers > 1 and not settings.CACHE_IS_SHARED:
+        raise RuntimeError(
+            f'GUNICORN_WORKERS={workers} требует общего кеша: задайте '
+            'CACHE_BACKEND и CACHE_LOCATION (например, memcached)')
+
+
+def when_ready(server):
+    """Мастер с загруженным приложением заполняет кеш справочников."""
+    if preload_app:
+        from foodgram import warmup
+        warmup.warm_up()
+
+
+def post_fork(server, worker):
+    """
+    Воркер не должен пользоваться соединениями мастера с базой
+    и кешем: после прогрева в мастере открыт сокет memcached.
+    """
+    if preload_app:
+        from django.core.cache import caches
+        from django.db import connections
+        connections.close_all()
+        for cache in caches.all():
+            cache.close()
+
+
+def post_worker_init(worker):
+    """Без preload каждый воркер прогревается сам до первых запросов."""
+    if not preload_app:
+        from foodgram import warmup
+        warmup.warm_up()
+
+
+def child_exit(server, worker):
+    """Файл метрик завершившегося воркера сливается в общий архив."""
+    from foodgram import metrics
+    metrics.mark_process_dead(worker.pid)
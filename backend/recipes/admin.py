@@ -1,16 +1,101 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
 
+from api import deletion
 from recipes.models import (BuyRecipe,
+                            DeletionJob,
                             Ingredient,
+                            IngredientRecipe,
                             FavoriteRecipe,
                             Recipe,
                             Tag)
 from users.models import Follow, User
 
 
+def count_related(model, field, **filters):
+    """
+    Число связанных строк подзапросом по индексу внешнего ключа:
+    в отличие от нескольких Count() через JOIN строки не размножаются.
+    """
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}, **filters)
+        .order_by().values(field).annotate(total=Count('pk'))
+        .values('total'),
+        output_field=IntegerField()
+    ), 0)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Для списка без фильтров и поиска на PostgreSQL число строк берется
+    из статистики планировщика (pg_class.reltuples), если оно больше
+    ADMIN_ESTIMATED_COUNT_THRESHOLD, вместо COUNT(*) по всей таблице.
+    Оценка приблизительная и учитывает строки, ожидающие DeletionJob.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        # Без фильтров и поиска условия совпадают с менеджером модели
+        # (у рецептов и пользователей это скрытие удаленных).
+        if queryset.query.where == queryset.model._default_manager.all(
+        ).query.where:
+            estimate = self.estimate(queryset.model, queryset.db)
+            if estimate > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        # Подзапросы-аннотации для подсчета не нужны.
+        return queryset.values('pk').count()
+
+    @staticmethod
+    def estimate(model, using):
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class '
+                           'WHERE oid = %s::regclass',
+                           [model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список большой таблицы без полного COUNT(*)."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class TombstoneAdminMixin:
+    """
+    Удаление отметкой deleted_at: страница подтверждения не собирает
+    связанные объекты, строки удаляет DeletionJob.
+    """
+    tombstone = None
+
+    def get_deleted_objects(self, objs, request):
+        return ([str(obj) for obj in objs],
+                {self.model._meta.verbose_name_plural: len(objs)},
+                set(), [])
+
+    def delete_model(self, request, obj):
+        self.tombstone(obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            self.tombstone(obj)
+
+
 @admin.register(User)
-class UserAdmins(UserAdmin):
+class UserAdmins(TombstoneAdminMixin, UserAdmin):
+    tombstone = staticmethod(deletion.tombstone_user)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     list_display = (
         'username',
         'email',
@@ -19,39 +104,63 @@ class UserAdmins(UserAdmin):
         'count_follow',
         'count_recipe',
     )
-    list_filter = ('username', 'email')
-    search_fields = ('username',)
-
+    list_filter = ('is_staff', 'is_active')
+    search_fields = ('username', 'email')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            follow_count=count_related(Follow, 'following'),
+            recipe_count=count_related(Recipe, 'author',
+                                       deleted_at__isnull=True),
+        )
+
+    @admin.display(description='Кол-во подписчиков',
+                   ordering='follow_count')
     def count_follow(self, obj):
-        return obj.following.count()
+        return obj.follow_count
 
+    @admin.display(description='Кол-во рецептов', ordering='recipe_count')
     def count_recipe(self, obj):
-        return obj.recipes.count()
-    count_follow.short_description = 'Кол-во подписчиков'
-    count_recipe.short_description = 'Кол-во рецептов'
+        return obj.recipe_count
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(LargeTableAdmin):
     list_display = (
         'name',
         'measurement_unit',
     )
-    list_filter = ('name',)
+    search_fields = ('^name',)
+
+
+class IngredientRecipeInline(admin.TabularInline):
+    model = IngredientRecipe
+    autocomplete_fields = ('ingredient',)
+    extra = 0
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(TombstoneAdminMixin, LargeTableAdmin):
+    tombstone = staticmethod(deletion.tombstone_recipe)
     list_display = (
         'name',
         'author',
         'count_favorites',
     )
-    list_filter = ('author', 'name', 'tags')
-
+    list_select_related = ('author',)
+    list_filter = ('tags',)
+    search_fields = ('name', 'author__username')
+    autocomplete_fields = ('author', 'tags')
+    inlines = (IngredientRecipeInline,)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            favorites_count=count_related(FavoriteRecipe, 'recipe'))
+
+    @admin.display(description='Кол-во избранных',
+                   ordering='favorites_count')
     def count_favorites(self, obj):
-        return obj.favorites.count()
-    count_favorites.short_description = 'Кол-во избранных'
+        return obj.favorites_count
 
 
 @admin.register(Tag)
@@ -61,18 +170,44 @@ class TagAdmin(admin.ModelAdmin):
         'slug',
         'color',
     )
+    search_fields = ('name', 'slug')
 
 
 @admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = (
         'user',
         'following',
     )
-    list_filter = ('user',)
-    search_fields = ('user',)
+    list_select_related = ('user', 'following')
+    raw_id_fields = ('user', 'following')
+    search_fields = ('user__username', 'following__username')
+
+
+@admin.register(BuyRecipe, FavoriteRecipe)
+class UserRecipeAdmin(LargeTableAdmin):
+    list_display = (
+        'user',
+        'recipe',
+    )
+    list_select_related = ('user', 'recipe')
+    raw_id_fields = ('user', 'recipe')
+    search_fields = ('user__username', 'recipe__name')
+
+
+@admin.register(DeletionJob)
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'kind',
+        'object_id',
+        'status',
+        'step',
+        'deleted',
+        'created_at',
+        'finished_at',
+    )
+    list_filter = ('status', 'kind')
+    readonly_fields = [field.name for field in DeletionJob._meta.fields]
 
 
-admin.site.register(BuyRecipe)
-admin.site.register(FavoriteRecipe)
 admin.site.empty_value_display = 'Не задано'
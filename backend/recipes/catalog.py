@@ -0,0 +1,199 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Ingredient
+
+MAGIC = b'FGCAT001'
+# Сигнатура, версия, число записей и смещения шести секций файла.
+HEADER = struct.Struct('<8sQI6I')
+ALIGN = 8
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0
+
+
+class CatalogSnapshot:
+    """
+    Снимок справочника ингредиентов, отображенный в память только для
+    чтения. Страницы файла общие для всех воркеров, в памяти процесса
+    хранятся лишь представления memoryview над ними.
+
+    Секции файла:
+    - ids: id ингредиентов по возрастанию (int64);
+    - offsets: границы строк в text (uint32): название записи i
+      занимает offsets[2i]..offsets[2i+1], единица измерения -
+      offsets[2i+1]..offsets[2i+2];
+    - text: UTF-8 названия и единицы измерения;
+    - order: номера записей в порядке названий в нижнем регистре;
+    - key_offsets и keys: названия в нижнем регистре в порядке order
+      для поиска по префиксу.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count, *sections = HEADER.unpack_from(
+            self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: неизвестный формат снимка')
+        view = memoryview(self._mmap)
+        ids, offsets, text, order, key_offsets, keys = sections
+        count = self.count
+        self._ids = view[ids:ids + count * 8].cast('q')
+        self._offsets = view[offsets:offsets + (2 * count + 1) * 4].cast('I')
+        self._text = view[text:order]
+        self._order = view[order:order + count * 4].cast('I')
+        self._key_offsets = view[
+            key_offsets:key_offsets + (count + 1) * 4].cast('I')
+        self._keys = self._mmap
+        self._keys_start = keys
+
+    def __len__(self):
+        return self.count
+
+    def get(self, pk):
+        """Ингредиент по id двоичным поиском или None."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._ids[middle] < pk:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._ids[low] == pk:
+            return self._item(low)
+        return None
+
+    def search(self, prefix=''):
+        """Ингредиенты, название которых начинается с prefix без учета
+        регистра, в порядке названий."""
+        prefix = prefix.lower().encode()
+        position = self._lower_bound(prefix)
+        result = []
+        while (position < self.count
+               and self._key(position).startswith(prefix)):
+            result.append(self._item(self._order[position]))
+            position += 1
+        return result
+
+    def _lower_bound(self, prefix):
+        # Порядок байтов UTF-8 совпадает с порядком строк.
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _key(self, position):
+        start = self._keys_start
+        return self._keys[start + self._key_offsets[position]:
+                          start + self._key_offsets[position + 1]]
+
+    def _item(self, index):
+        offsets = self._offsets
+        return {
+            'id': self._ids[index],
+            'name': str(self._text[offsets[2 * index]:
+                                   offsets[2 * index + 1]], 'utf-8'),
+            'measurement_unit': str(self._text[offsets[2 * index + 1]:
+                                               offsets[2 * index + 2]],
+                                    'utf-8'),
+        }
+
+
+def build_snapshot(path=None):
+    """
+    Собирает снимок из таблицы Ingredient во временный файл рядом
+    с целевым и атомарно подменяет его: читатели видят либо старый,
+    либо новый файл целиком.
+    """
+    path = path or settings.CATALOG_SNAPSHOT_PATH
+    ids = array('q')
+    offsets = array('I', [0])
+    text = bytearray()
+    names = []
+    for pk, name, unit in Ingredient.objects.order_by('id').values_list(
+            'id', 'name', 'measurement_unit').iterator():
+        ids.append(pk)
+        text += name.encode()
+        offsets.append(len(text))
+        text += unit.encode()
+        offsets.append(len(text))
+        names.append(name.lower())
+    order = array('I', sorted(range(len(ids)),
+                              key=lambda index: (names[index], index)))
+    key_offsets = array('I', [0])
+    keys = bytearray()
+    for index in order:
+        keys += names[index].encode()
+        key_offsets.append(len(keys))
+
+    sections = []
+    body = bytearray()
+    for section in (ids, offsets, text, order, key_offsets, keys):
+        body += bytes(-(HEADER.size + len(body)) % ALIGN)
+        sections.append(HEADER.size + len(body))
+        body += section.tobytes() if isinstance(section, array) else section
+    header = HEADER.pack(MAGIC, time.time_ns(), len(ids), *sections)
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(body)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(ids)
+
+
+def schedule_build():
+    """Пересборка после фиксации транзакции, одна на транзакцию
+    при любом числе измененных ингредиентов."""
+    if connection.in_atomic_block and any(
+            func is build_snapshot for _, func in connection.run_on_commit):
+        return
+    transaction.on_commit(build_snapshot)
+
+
+def get_snapshot():
+    """
+    Текущий снимок процесса или None, если файла еще нет. Подмена файла
+    проверяется не чаще раза в CATALOG_SNAPSHOT_CHECK секунд; старый
+    снимок остается валидным, пока на него есть ссылки.
+    """
+    global _snapshot, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < settings.CATALOG_SNAPSHOT_CHECK:
+        return _snapshot
+    with _lock:
+        if now - _checked_at < settings.CATALOG_SNAPSHOT_CHECK:
+            return _snapshot
+        try:
+            stat = os.stat(settings.CATALOG_SNAPSHOT_PATH)
+        except FileNotFoundError:
+            _snapshot = None
+        else:
+            if (_snapshot is None
+                    or _snapshot.identity != (stat.st_ino, stat.st_mtime_ns)):
+                _snapshot = CatalogSnapshot(settings.CATALOG_SNAPSHOT_PATH)
+        _checked_at = now
+    return _snapshot
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:12
+
+from django.db import migrations, models
+
+
+def fill_changes(apps, schema_editor):
+    """Существующие рецепты попадают в журнал в порядке публикации."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeChange = apps.get_model('recipes', 'RecipeChange')
+    Recipe.objects.update(updated_at=models.F('pub_date'))
+    RecipeChange.objects.bulk_create(
+        (RecipeChange(recipe_id=recipe_id, action='updated')
+         for recipe_id in Recipe.objects.order_by(
+             'pub_date', 'id').values_list('id', flat=True).iterator()),
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipedocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe_id', models.BigIntegerField(db_index=True, verbose_name='Рецепт')),
+                ('action', models.CharField(choices=[('updated', 'Изменен'), ('deleted', 'Удален')], max_length=7, verbose_name='Действие')),
+                ('changed_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Изменение рецепта',
+                'verbose_name_plural': 'Изменения рецептов',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(fill_changes, migrations.RunPython.noop),
+    ]
@@ -18,6 +18,13 @@ class BaseModel(models.Model):
         abstract = True
 
 
+class AliveManager(models.Manager):
+    """Записи без отметки об удалении."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Tag(models.Model):
     """Модель тега."""
 
@@ -93,7 +100,8 @@ class Recipe(BaseModel):
         through='IngredientRecipe'
     )
     image = models.ImageField(
-        upload_to='recipes/images/'
+        upload_to='recipes/images/',
+        db_index=True
     )
     text = models.TextField(
         'Текст',
@@ -115,6 +123,19 @@ class Recipe(BaseModel):
         auto_now_add=True,
         db_index=True,
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+    )
+    deleted_at = models.DateTimeField(
+        'Дата удаления',
+        null=True,
+        blank=True,
+        db_index=True,
+    )
+
+    objects = AliveManager()
+    all_objects = models.Manager()
 
     class Meta:
         ordering = ('-pub_date',)
@@ -127,7 +148,6 @@ class Recipe(BaseModel):
 
     def clean(self):
         self.name = self.name.lower()
-        self.measurement_unit = self.measurement_unit.lower()
         super().clean()
 
 
@@ -225,3 +245,136 @@ class BuyRecipe(models.Model):
 
     def __str__(self):
         return f'{self.recipe} {self.user}'
+
+
+class RecipeDocument(models.Model):
+    """
+    Денормализованное представление рецепта без пользовательских флагов,
+    из которого читаются список и детальная страница рецепта.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        primary_key=True,
+        related_name='document',
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт'
+    )
+    payload = models.JSONField(verbose_name='Документ')
+    updated_at = models.DateTimeField(
+        'Дата обновления',
+        auto_now=True
+    )
+
+    class Meta:
+        verbose_name = 'Документ рецепта'
+        verbose_name_plural = 'Документы рецептов'
+
+    def __str__(self):
+        return f'{self.recipe_id}'
+
+
+class RecipeChange(models.Model):
+    """
+    Журнал изменений рецептов для инкрементальной синхронизации.
+    На рецепт хранится одна последняя запись, для удаленного
+    рецепта она остается надгробием.
+    """
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTIONS = (
+        (UPDATED, 'Изменен'),
+        (DELETED, 'Удален'),
+    )
+
+    recipe_id = models.BigIntegerField(
+        'Рецепт',
+        db_index=True
+    )
+    action = models.CharField(
+        'Действие',
+        max_length=7,
+        choices=ACTIONS
+    )
+    changed_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now_add=True
+    )
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name = 'Изменение рецепта'
+        verbose_name_plural = 'Изменения рецептов'
+
+    def __str__(self):
+        return f'{self.recipe_id} {self.action}'
+
+
+class DeletionJob(models.Model):
+    """
+    Фоновое удаление пользователя или рецепта, отмеченного deleted_at:
+    связанные строки удаляются пачками командой process_deletions.
+    """
+    USER = 'user'
+    RECIPE = 'recipe'
+    KINDS = (
+        (USER, 'Пользователь'),
+        (RECIPE, 'Рецепт'),
+    )
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Завершено'),
+        (FAILED, 'Ошибка'),
+    )
+
+    kind = models.CharField(
+        'Объект',
+        max_length=6,
+        choices=KINDS
+    )
+    object_id = models.BigIntegerField('Id объекта')
+    status = models.CharField(
+        'Статус',
+        max_length=7,
+        choices=STATUSES,
+        default=PENDING,
+        db_index=True
+    )
+    step = models.CharField(
+        'Этап',
+        max_length=32,
+        blank=True
+    )
+    deleted = models.PositiveBigIntegerField(
+        'Удалено строк',
+        default=0
+    )
+    error = models.TextField(
+        'Ошибка',
+        blank=True
+    )
+    created_at = models.DateTimeField(
+        'Дата создания',
+        auto_now_add=True
+    )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True
+    )
+    finished_at = models.DateTimeField(
+        'Дата завершения',
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name = 'Задача удаления'
+        verbose_name_plural = 'Задачи удаления'
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id} {self.status}'
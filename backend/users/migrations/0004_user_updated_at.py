@@ -0,0 +1,24 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:14
+
+from django.db import migrations, models
+
+
+def fill_updated_at(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    User.objects.update(updated_at=models.F('date_joined'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20231108_2000'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+    ]
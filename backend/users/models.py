@@ -1,10 +1,17 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
 
 from foodgram.constants import CONST
 from .validators import validate_username
 
 
+class AliveUserManager(UserManager):
+    """Пользователи без отметки об удалении."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class User(AbstractUser):
     """Модель пользователя"""
     username = models.CharField(
@@ -29,6 +36,21 @@ class User(AbstractUser):
         max_length=CONST['max_legth_charfield'],
         verbose_name='Пароль'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+    deleted_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        verbose_name='Дата удаления'
+    )
+    # Удаленные пользователи скрыты везде, включая авторизацию,
+    # до окончательного удаления DeletionJob доступны через all_objects.
+    objects = AliveUserManager()
+    all_objects = UserManager()
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [
         'username',